@@ -2,10 +2,13 @@
 # --- Import required libraries ---
 import tkinter as tk
 from tkinter import ttk, messagebox
-from datetime import datetime, timedelta
-import matplotlib.pyplot as plt
+from datetime import date, datetime, timedelta
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
+import numpy as np
+import queue
 import random
+import threading
 import json
 import os
 
@@ -37,6 +40,95 @@ class Item:
         self.typ = typ
         self.price = price
 
+# --- Aggregation ---
+TOTAL_INCOME = "Total income"
+TOTAL_EXPENSE = "Total expense"
+GRAPH_MAX_POINTS = 120
+GRAPH_PROGRESS_STEP = 20000  # operations between progress reports from the graph worker
+GRAPH_POLL_MS = 50
+# Finest first, with the fewest days a bucket can cover, so the bucket count of a range
+# can be bounded before any buckets are made. Years only keep ranges past ~30 years bounded.
+RESOLUTIONS = (("day", 1), ("week", 7), ("month", 28), ("quarter", 89), ("year", 365))
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()  # numpy day 0; 1970-01-01 was a Thursday
+
+def bucket_starts(resolution, start, end):
+    # First day ordinal of every calendar bucket (ISO weeks start on Monday) overlapping
+    # start..end; the first bucket is clipped to start.
+    first = np.datetime64(date.fromordinal(start))
+    last = np.datetime64(date.fromordinal(end))
+    if resolution == "day":
+        days = np.arange(first, last + 1)
+    elif resolution == "week":
+        days = np.arange(first - (first.astype(np.int64) + 3) % 7, last + 1, 7)
+    elif resolution == "year":
+        days = np.arange(first.astype("datetime64[Y]"), last.astype("datetime64[Y]") + 1).astype("datetime64[D]")
+    else:
+        step = 3 if resolution == "quarter" else 1
+        month = first.astype("datetime64[M]")
+        month -= month.astype(np.int64) % step
+        days = np.arange(month, last.astype("datetime64[M]") + 1, step).astype("datetime64[D]")
+    days = days.astype(np.int64) + EPOCH_ORDINAL
+    days[0] = start
+    return days
+
+def pick_resolution(start, end):
+    for resolution, days in RESOLUTIONS:
+        if (end - start) // days + 2 <= GRAPH_MAX_POINTS:
+            return resolution
+    return RESOLUTIONS[-1][0]
+
+class DailyAggregates:
+    # Sums per (day, category) over the whole history in one pass: every operation and
+    # purchased item becomes a (day, category, amount) row and np.bincount adds them up.
+    # Running totals over the days are the calendar index: any bucket of any length sums
+    # with two lookups, so a series costs the same for a week or for ten years.
+    # `progress(fraction)` is called every GRAPH_PROGRESS_STEP operations; returning
+    # False stops the pass and leaves `cancelled` set.
+    def __init__(self, history, progress=None):
+        self.ids = {TOTAL_INCOME: 0, TOTAL_EXPENSE: 1}
+        self.cancelled = False
+        days, cats, amounts = [], [], []
+        for n, op in enumerate(history):
+            if progress is not None and n % GRAPH_PROGRESS_STEP == 0 and not progress(n / len(history)):
+                self.cancelled = True
+                return
+            day = op.timestamp.toordinal()
+            if op.kind == "income":
+                days += (day, day)
+                cats += (0, self.ids.setdefault("income", len(self.ids)))
+                amounts += (op.amount, op.amount)
+            elif op.kind == "purchase":
+                days.append(day)
+                cats.append(1)
+                amounts.append(op.amount)
+                for item in op.items:
+                    days.append(day)
+                    cats.append(self.ids.setdefault(item.typ, len(self.ids)))
+                    amounts.append(item.price)
+        # Everything but the two totals, which always come last in the checkbox list.
+        self.categories = sorted(list(self.ids)[2:])
+        if days:
+            days = np.array(days, dtype=np.int64)
+            self.first = int(days.min())
+            count = int(days.max()) - self.first + 1
+            flat = (days - self.first) * len(self.ids) + np.array(cats, dtype=np.int64)
+            self.table = np.bincount(flat, weights=np.array(amounts, dtype=float),
+                                     minlength=count * len(self.ids)).reshape(count, len(self.ids))
+        else:
+            self.first = 0
+            self.table = np.zeros((0, len(self.ids)))
+        self.last = self.first + len(self.table) - 1
+        self.running = np.vstack([np.zeros((1, len(self.ids))), np.cumsum(self.table, axis=0)])
+
+    def series(self, category, starts, end):
+        # Sums of the buckets beginning at each of `starts` (day ordinals), the last one
+        # running through `end`; days without operations count as 0.
+        cid = self.ids.get(category)
+        if cid is None:
+            return np.zeros(len(starts))
+        edges = np.clip(np.append(starts, end + 1) - self.first, 0, len(self.table))
+        return np.diff(self.running[edges, cid])
+
 # --- Main Application Class ---
 class FinanceApp:
     def __init__(self, root):
@@ -95,69 +187,195 @@ class FinanceApp:
         self.graph_frame = tk.Frame(self.graph_container, bg="#323232")
         self.graph_frame.pack(side="left", fill="both", expand=True)
 
-        self.timeframe2 = ttk.Combobox(self.toolbar, values=["Week", "Month", "Year"])
+        self.timeframe2 = ttk.Combobox(self.toolbar, values=["Week", "Month", "Year", "All", "Custom"])
         self.timeframe2.set("Month")
         self.timeframe2.pack(pady=5)
+        self.timeframe2.bind("<<ComboboxSelected>>", lambda e: self.draw_graph())
+
+        # Used by "Custom": any range of days, YYYY-MM-DD, both ends included.
+        range_frame = tk.Frame(self.toolbar, bg="#2a2a2a")
+        range_frame.pack(pady=2)
+        self.graph_from = tk.Entry(range_frame, width=11)
+        self.graph_from.pack(side="left", padx=2)
+        self.graph_to = tk.Entry(range_frame, width=11)
+        self.graph_to.pack(side="left", padx=2)
+        self.graph_resolution = tk.Label(self.toolbar, bg="#2a2a2a", fg="white")
+        self.graph_resolution.pack(pady=2)
+        # Shown only while the worker aggregates history.
+        self.graph_progress = ttk.Progressbar(self.toolbar, length=150, maximum=1.0)
 
         tk.Button(self.toolbar, text="Update Graph", command=self.draw_graph).pack(pady=5)
         self.line_check_vars = {}
         self.line_colors = {}
+        self.graph_categories = None
+        self.graph_timeframe = None
+        self.graph_cache_key = None
+        self.graph_cache = {}
+        self.graph_totals = None
+        self.graph_line_data = {}
+        self.graph_pending = None
+        self.graph_cancel = None
+        self.graph_queue = queue.Queue()
+
+        # One figure and canvas for the life of the tab; redraws only change line data.
+        # A plain Figure is not registered with pyplot, so nothing accumulates there.
+        self.graph_figure = Figure(figsize=(7, 5))
+        self.graph_ax = self.graph_figure.add_subplot()
+        self.graph_ax.xaxis_date()
+        self.graph_ax.tick_params(axis="x", labelrotation=30)
+        self.graph_figure.subplots_adjust(bottom=0.2)
+        self.graph_canvas = FigureCanvasTkAgg(self.graph_figure, master=self.graph_frame)
+        self.graph_canvas.get_tk_widget().pack()
 
     def draw_graph(self):
-        for widget in self.graph_frame.winfo_children():
-            widget.destroy()
-        for widget in self.toolbar.winfo_children():
-            if isinstance(widget, tk.Checkbutton):
-                widget.destroy()
+        # Recomputes only what the cache lacks: checkboxes are rebuilt when the category
+        # set changes, and each visible line gets its cached series for the timeframe.
+        if not self.check_graph_cache():
+            return  # called again, with whatever timeframe is selected then, once the worker is done
+        timeframe = self.graph_range()
+        if timeframe is None:
+            self.graph_resolution.configure(text="Invalid range")
+            return
+        self.graph_timeframe = timeframe
+        self.graph_resolution.configure(text=f"Points per {pick_resolution(*timeframe)}")
+        self.sync_graph_checkboxes()
+        for cat in self.line_check_vars:
+            self.update_line(cat)
+        self.redraw_graph()
 
+    def check_graph_cache(self):
+        # History in this app only grows by appending or is replaced wholesale, and the
+        # timeframes end today, so this key changes whenever a cached series could.
+        # A stale cache is rebuilt by a worker thread; a worker still busy with an older
+        # key is cancelled. Returns whether the cache is current.
+        key = (id(self.history), len(self.history), datetime.now().date())
+        if key == self.graph_cache_key:
+            return True
+        if key != self.graph_pending:
+            if self.graph_cancel is not None:
+                self.graph_cancel.set()
+            else:
+                self.graph_progress.pack(pady=2, after=self.graph_resolution)
+                self.root.after(GRAPH_POLL_MS, self.poll_graph_worker)
+            self.graph_pending = key
+            self.graph_cancel = threading.Event()
+            self.graph_progress["value"] = 0
+            threading.Thread(target=self.graph_worker, args=(list(self.history), key, self.graph_cancel),
+                             daemon=True).start()
+        return False
+
+    def graph_worker(self, history, key, cancel):
+        def progress(fraction):
+            self.graph_queue.put((key, fraction))
+            return not cancel.is_set()
+        totals = DailyAggregates(history, progress)
+        if not totals.cancelled:
+            self.graph_queue.put((key, totals))
+
+    def poll_graph_worker(self):
+        # Tk thread: shows progress and takes over the finished aggregates. Messages from
+        # cancelled workers are dropped.
+        while True:
+            try:
+                key, result = self.graph_queue.get_nowait()
+            except queue.Empty:
+                break
+            if key != self.graph_pending:
+                continue
+            if isinstance(result, DailyAggregates):
+                self.graph_pending = self.graph_cancel = None
+                self.graph_cache_key = key
+                self.graph_totals = result
+                self.graph_cache = {}
+                self.graph_progress.pack_forget()
+                self.draw_graph()
+                return
+            self.graph_progress["value"] = result
+        if self.graph_pending is not None:
+            self.root.after(GRAPH_POLL_MS, self.poll_graph_worker)
+
+    def graph_range(self):
+        # (first, last) day ordinals of the selected timeframe, or None for a bad custom range.
+        today = datetime.now().date()
         tf = self.timeframe2.get()
-        now = datetime.now()
+        if tf == "Custom":
+            try:
+                start = datetime.strptime(self.graph_from.get().strip(), "%Y-%m-%d").date()
+                end = datetime.strptime(self.graph_to.get().strip(), "%Y-%m-%d").date()
+            except ValueError:
+                return None
+            if end < start:
+                return None
+            return start.toordinal(), end.toordinal()
+        if tf == "All":
+            first = self.graph_totals.first if len(self.graph_totals.table) else today.toordinal()
+            return min(first, today.toordinal()), max(self.graph_totals.last, today.toordinal())
         if tf == "Week":
-            cutoff = now - timedelta(weeks=1)
+            cutoff = today - timedelta(weeks=1)
         elif tf == "Month":
-            cutoff = now - timedelta(days=30)
+            cutoff = today - timedelta(days=30)
         else:
-            cutoff = now - timedelta(days=365)
-
-        dates = [cutoff + timedelta(days=i) for i in range((now - cutoff).days + 1)]
-        income_types = set(op.kind if op.kind == "income" else item.typ for op in self.history for item in op.items if op.kind == "purchase")
-        purchase_types = set(item.typ for op in self.history if op.kind == "purchase" for item in op.items)
-        income_entries = set(op.kind for op in self.history if op.kind == "income")
+            cutoff = today - timedelta(days=365)
+        return cutoff.toordinal(), today.toordinal()
 
-        categories = list(purchase_types | income_entries) + ["Total income", "Total expense"]
+    def graph_series(self, cat, timeframe):
+        # Bucket starts for a range are shared by every category plotted over it.
+        series = self.graph_cache.get((cat, timeframe))
+        if series is None:
+            buckets = self.graph_cache.get((None, timeframe))
+            if buckets is None:
+                starts = bucket_starts(pick_resolution(*timeframe), *timeframe)
+                buckets = self.graph_cache[(None, timeframe)] = (starts, [datetime.fromordinal(int(d)) for d in starts])
+            starts, dates = buckets
+            series = self.graph_cache[(cat, timeframe)] = (dates, self.graph_totals.series(cat, starts, timeframe[1]))
+        return series
 
+    def sync_graph_checkboxes(self):
+        categories = self.graph_totals.categories + [TOTAL_INCOME, TOTAL_EXPENSE]
+        if categories == self.graph_categories:
+            return
+        self.graph_categories = categories
+        for widget in self.toolbar.winfo_children():
+            if isinstance(widget, tk.Checkbutton):
+                widget.destroy()
         for cat in categories:
-            var = tk.BooleanVar(value=(cat in ["Total income", "Total expense"]))
+            var = self.line_check_vars.get(cat)
+            if var is None:
+                var = self.line_check_vars[cat] = tk.BooleanVar(value=(cat in [TOTAL_INCOME, TOTAL_EXPENSE]))
             cb = tk.Checkbutton(self.toolbar, text=cat, variable=var, bg="#2a2a2a", fg="white", selectcolor="#444444",
-                                command=self.draw_graph)
+                                command=lambda cat=cat: self.toggle_line(cat))
             cb.pack(anchor="w")
-            self.line_check_vars[cat] = var
             if cat not in self.line_colors:
                 self.line_colors[cat] = random.choice(self.color_palette)
 
-        fig, ax = plt.subplots(figsize=(7, 5))
+    def toggle_line(self, cat):
+        self.update_line(cat)
+        self.redraw_graph()
 
-        for cat, var in self.line_check_vars.items():
-            if not var.get():
-                continue
-            ydata = []
-            for day in dates:
-                if cat == "Total income":
-                    val = sum(op.amount for op in self.history if op.kind == "income" and op.timestamp.date() == day.date())
-                elif cat == "Total expense":
-                    val = sum(op.amount for op in self.history if op.kind == "purchase" and op.timestamp.date() == day.date())
-                elif cat in purchase_types:
-                    val = sum(item.price for op in self.history if op.kind == "purchase" and op.timestamp.date() == day.date()
-                              for item in op.items if item.typ == cat)
-                elif cat in income_entries:
-                    val = sum(op.amount for op in self.history if op.kind == "income" and op.timestamp.date() == day.date())
-                else:
-                    val = 0
-                ydata.append(val)
-            ax.plot(dates, ydata, label=cat, color=self.line_colors.get(cat, 'gray'))
-
-        ax.legend()
-        fig.autofmt_xdate()
-        canvas = FigureCanvasTkAgg(fig, master=self.graph_frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack()
+    def update_line(self, cat):
+        # A line's data is replaced only when it was drawn for another timeframe or an
+        # older cache; otherwise showing or hiding it is just a visibility flip.
+        line = self.graph_lines.get(cat)
+        if not self.line_check_vars[cat].get() or cat not in self.graph_categories:
+            if line is not None:
+                line.set_visible(False)
+            return
+        if line is None:
+            line, = self.graph_ax.plot([], [], label=cat, color=self.line_colors.get(cat, 'gray'))
+            self.graph_lines[cat] = line
+        drawn = (self.graph_timeframe, self.graph_cache_key)
+        if self.graph_line_data.get(cat) != drawn:
+            self.graph_line_data[cat] = drawn
+            line.set_data(*self.graph_series(cat, drawn[0]))
+        line.set_visible(True)
+
+    def redraw_graph(self):
+        ax = self.graph_ax
+        shown = [line for line in self.graph_lines.values() if line.get_visible()]
+        if shown:
+            ax.legend(handles=shown)
+        elif ax.get_legend() is not None:
+            ax.get_legend().remove()
+        ax.relim(visible_only=True)
+        ax.autoscale_view()
+        self.graph_canvas.draw_idle()
@@ -1,15 +1,30 @@
+import argparse
+import csv
 import json
+import mmap
 import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right, insort
+import heapq
+import queue
+import sqlite3
 import string
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import time
 import tkinter as tk
 from selectors import SelectSelector
-from tkinter import ttk
+from tkinter import simpledialog, ttk
 from tkinter import scrolledtext
+from collections import deque
 from datetime import datetime, timedelta
 import matplotlib
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+import numpy as np
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+from matplotlib.figure import Figure
 import matplotlib.pyplot as plt
-from matplotlib.style.core import available
 
 matplotlib.use("Agg")
 
@@ -30,19 +45,66 @@ CHECKIN = "Check in"
 CHECKOUT = "Check out"
 DISMISS = "Dismiss"
 
+DATA_FILE = "fc_data.json"
+SNAPSHOT_FILE = "fc_data.snap"
+JOURNAL_FILE = "fc_data.log"
+DB_FILE = "fc_data.db"
+BIN_FILE = "fc_data.bin"
+ACCOUNTS_DIR = "fc_accounts"  # every subdirectory is an account; the current directory is MAIN_ACCOUNT
+MAIN_ACCOUNT = "Main"
+STORAGE_MODE = os.environ.get("FC_STORAGE", "json")  # 'json', 'journal', 'sqlite' or 'binary'
+COMPACT_MIN_RECORDS = 1000
+RECENT_OPERATIONS = 200
+LOAD_BATCH = 5000
+LOAD_POLL_MS = 30
+HISTORY_ROW_HEIGHT = 36
+HISTORY_ITEM_HEIGHT = 18
+CHART_PERIODS = {"Week": 7, "Month": 30, "Year": 365, "All": None}
+EPOCH = datetime(1970, 1, 1)  # also matplotlib's default date epoch
+EPOCH_DAY = EPOCH.toordinal()
+DAY_MICROS = 86400 * 1000000
+SEARCH_KINDS = ["All", "Income", "Expense", "Purchase", "Set balance"]
+OPERATION_CHUNK = 4096
+PROFILE = os.environ.get("FC_PROFILE", "")  # '1' to time UI hot paths, 'overlay' to also show them
+PROFILE_FILE = "fc_profile.json"
+PROFILE_WINDOW = 500
+PROFILE_SLOW_MS = 50
+PROFILE_OVERLAY_MS = 500
+AUTOSAVE_MS = 60000  # longest a change stays unsaved while the user keeps working
+AUTOSAVE_IDLE_MS = 2000  # quiet time after a change before it is saved
+AUTOSAVE_POLL_MS = 1000
+ITEM_TREE_BATCH = 500  # Items tab rows inserted per idle pass
+ITEM_TREE_STRIPES = ("even", "odd")
+MAX_CENTS = 2 ** 63 - 1
+
+compact_json = json.JSONEncoder(separators=(",", ":")).encode
+
 def from_cents(amount):
     return float(amount / 100)
 
 def to_cents(amount):
-    return int(amount * 100.0)
+    # OverflowError for inf, and for amounts the int64 history columns cannot hold.
+    cents = int(round(amount * 100.0))
+    if not -MAX_CENTS <= cents <= MAX_CENTS:
+        raise OverflowError("amount out of range")
+    return cents
+
+def to_micros(timestamp):
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
 
 class Item:
+    __slots__ = ("name", "item_type", "price", "count")
+
     def __init__(self, name, item_type, price, count = 1):
-        self.name = name
-        self.item_type = item_type
+        self.name = sys.intern(name)
+        self.item_type = sys.intern(item_type)
         self.price = price
         self.count = count
 
+    def to_dict(self):
+        return {"name": self.name, "item_type": self.item_type, "price": self.price, "count": self.count}
+
 class ItemGUI:
     def __init__(self, parent, app_ref, my_item):
         self.parent = parent
@@ -68,60 +130,2669 @@ class ItemGUI:
         plus_btn.pack(side="left", padx=5)
 
     def change_item_price(self, event):
-        self.my_item.price = to_cents(float(self.price_input.get()))
+        # Partial input such as "" or "-" keeps the last valid price until it parses.
+        try:
+            price = to_cents(float(self.price_input.get()))
+        except (ValueError, OverflowError):
+            return
+        if price == self.my_item.price:
+            return
+        self.app_ref.ledger.change_basket_item(self.my_item, price=price)
         self.update_item_display()
-        self.app_ref.update_pending()
+        self.app_ref.request_pending()
 
     def increase_count(self):
-        self.my_item.count += 1
+        self.app_ref.ledger.change_basket_item(self.my_item, count=self.my_item.count + 1)
         self.update_item_display()
-        self.app_ref.update_pending()
+        self.app_ref.request_pending()
 
     def decrease_count(self):
-        self.my_item.count -= 1
+        self.app_ref.ledger.change_basket_item(self.my_item, count=self.my_item.count - 1)
         self.update_item_display()
-        self.app_ref.update_pending()
+        self.app_ref.request_pending()
 
     def update_item_display(self):
         if self.my_item.count < 1:
             self.row.destroy()
-            self.app_ref.item_list.remove(self.my_item)
+            self.app_ref.ledger.remove_from_basket(self.my_item)
             return
         self.total_cost_d.configure(text=f"{from_cents(self.my_item.price * self.my_item.count):.2f}")
         self.count_label.configure(text=f"{self.my_item.count}")
 
 class Operation:
+    # amount and balance are in cents like Item.price; time is microseconds since EPOCH.
+    __slots__ = ("kind", "amount", "balance", "time", "items")
+
     def __init__(self, kind, amount, balance, timestamp=None, items=None):
-        self.kind = kind  # 'income' or 'purchase'
+        self.kind = sys.intern(kind)
         self.amount = amount
-        self.timestamp = timestamp or datetime.now()
-        self.items = items or []
         self.balance = balance
+        self.time = to_micros(timestamp or datetime.now())
+        self.items = items or []
+
+    @property
+    def timestamp(self):
+        return EPOCH + timedelta(microseconds=self.time)
 
     def to_dict(self):
         return {
             "kind": self.kind,
-            "amount": self.amount,
+            "amount": from_cents(self.amount),
             "timestamp": self.timestamp.isoformat(),
-            "balance": self.balance,
-            "items": [item.__dict__ for item in self.items]
+            "balance": from_cents(self.balance),
+            "items": [item.to_dict() for item in self.items]
         }
 
     @staticmethod
     def from_dict(data):
         timestamp = datetime.fromisoformat(data["timestamp"])
         items = [Item(**i) for i in data.get("items", [])]
-        return Operation(data["kind"], data["amount"], data["balance"], timestamp, items)
+        return Operation(data["kind"], to_cents(data["amount"]), to_cents(data["balance"]), timestamp, items)
+
+
+class OperationChunk:
+    # Up to OPERATION_CHUNK operations stored column-wise; item rows of operation j are
+    # first_item[j]:first_item[j + 1]. Strings are ids into the owning log's string table.
+    __slots__ = ("kind", "amount", "balance", "time", "first_item", "name", "item_type", "price", "count")
+
+    def __init__(self):
+        self.kind = array("I")
+        self.amount = array("q")
+        self.balance = array("q")
+        self.time = array("q")
+        self.first_item = array("I", [0])
+        self.name = array("I")
+        self.item_type = array("I")
+        self.price = array("q")
+        self.count = array("i")
+
+    def __len__(self):
+        return len(self.kind)
+
+    def copy(self):
+        chunk = OperationChunk.__new__(OperationChunk)
+        for name in self.__slots__:
+            setattr(chunk, name, getattr(self, name)[:])
+        return chunk
+
+    def append(self, op, intern):
+        self.kind.append(intern(op.kind))
+        self.amount.append(op.amount)
+        self.balance.append(op.balance)
+        self.time.append(op.time)
+        for item in op.items:
+            self.name.append(intern(item.name))
+            self.item_type.append(intern(item.item_type))
+            self.price.append(item.price)
+            self.count.append(item.count)
+        self.first_item.append(len(self.name))
+
+    def get(self, j, strings):
+        op = Operation.__new__(Operation)
+        op.kind = strings[self.kind[j]]
+        op.amount = self.amount[j]
+        op.balance = self.balance[j]
+        op.time = self.time[j]
+        op.items = [Item(strings[self.name[k]], strings[self.item_type[k]], self.price[k], self.count[k])
+                    for k in range(self.first_item[j], self.first_item[j + 1])]
+        return op
+
+    def replace(self, j, op, intern):
+        self.kind[j] = intern(op.kind)
+        self.amount[j] = op.amount
+        self.balance[j] = op.balance
+        self.time[j] = op.time
+        a, b = self.first_item[j], self.first_item[j + 1]
+        self.name[a:b] = array("I", [intern(item.name) for item in op.items])
+        self.item_type[a:b] = array("I", [intern(item.item_type) for item in op.items])
+        self.price[a:b] = array("q", [item.price for item in op.items])
+        self.count[a:b] = array("i", [item.count for item in op.items])
+        first = np.frombuffer(self.first_item, dtype=np.uint32)[j + 1:]
+        if len(op.items) > b - a:
+            first += len(op.items) - (b - a)
+        elif len(op.items) < b - a:
+            first -= (b - a) - len(op.items)
+
+    def delete(self, j):
+        a, b = self.first_item[j], self.first_item[j + 1]
+        for column in (self.kind, self.amount, self.balance, self.time):
+            del column[j]
+        for column in (self.name, self.item_type, self.price, self.count):
+            del column[a:b]
+        del self.first_item[j + 1]
+        if b > a:
+            np.frombuffer(self.first_item, dtype=np.uint32)[j + 1:] -= b - a
+
+    def truncate(self, j):
+        a = self.first_item[j]
+        for column in (self.kind, self.amount, self.balance, self.time):
+            del column[j:]
+        for column in (self.name, self.item_type, self.price, self.count):
+            del column[a:]
+        del self.first_item[j + 1:]
+
+    def flows(self, purchase, reset):
+        # Cent delta of each operation on the running balance; a "Set balance" is a
+        # checkpoint rather than a flow and counts as 0.
+        kinds = np.frombuffer(self.kind, dtype=np.uint32)
+        amounts = np.frombuffer(self.amount, dtype=np.int64)
+        return np.where(kinds == purchase, -amounts, np.where(kinds == reset, 0, amounts))
+
+
+class OperationLog:
+    # List-like, append-mostly store of operations in fixed-size columnar chunks.
+    # Indexing materializes an Operation; older history is prepended as whole chunks.
+    # A chunk's balances are its stored column plus its entry in `offsets`, a Fenwick
+    # tree over per-chunk differences, so moving the balances of whole chunks after an
+    # edit is O(log chunks). The last chunk's offset is kept at 0 for appends.
+    def __init__(self, operations=()):
+        self.strings = []
+        self.string_ids = {}
+        self.chunks = []
+        self.starts = [0]
+        self.shared = set()
+        self.offsets = Fenwick()
+        self.extend(operations)
+
+    def intern(self, value):
+        sid = self.string_ids.get(value)
+        if sid is None:
+            sid = self.string_ids[value] = len(self.strings)
+            self.strings.append(sys.intern(value))
+        return sid
+
+    def __len__(self):
+        return self.starts[-1]
+
+    def snapshot(self):
+        # A copy for a background writer. Chunks are shared, except the tail which is
+        # copied; until the writer calls release(), in-place edits copy a chunk first.
+        copy = OperationLog.__new__(OperationLog)
+        copy.strings = list(self.strings)
+        copy.string_ids = dict(self.string_ids)
+        copy.chunks = list(self.chunks)
+        copy.starts = list(self.starts)
+        copy.shared = set()
+        copy.offsets = self.offsets.copy()
+        if copy.chunks:
+            copy.chunks[-1] = copy.chunks[-1].copy()
+        self.shared = {id(chunk) for chunk in self.chunks}
+        return copy
+
+    def release(self):
+        self.shared = set()
+
+    def writable(self, c):
+        chunk = self.chunks[c]
+        if id(chunk) in self.shared:
+            chunk = self.chunks[c] = chunk.copy()
+        return chunk
+
+    def append(self, op):
+        if not self.chunks or len(self.chunks[-1]) >= OPERATION_CHUNK:
+            self.chunks.append(OperationChunk())
+            self.starts.append(self.starts[-1])
+            self.offsets.append(0)
+        self.writable(len(self.chunks) - 1).append(op, self.intern)
+        self.starts[-1] += 1
+
+    def extend(self, operations):
+        # Fills chunks column by column, which is much cheaper than per-operation appends.
+        operations = list(operations)
+        intern = self.intern
+        done = 0
+        while done < len(operations):
+            if not self.chunks or len(self.chunks[-1]) >= OPERATION_CHUNK:
+                self.chunks.append(OperationChunk())
+                self.starts.append(self.starts[-1])
+                self.offsets.append(0)
+            chunk = self.writable(len(self.chunks) - 1)
+            part = operations[done:done + OPERATION_CHUNK - len(chunk)]
+            chunk.kind.extend([intern(op.kind) for op in part])
+            chunk.amount.extend([op.amount for op in part])
+            chunk.balance.extend([op.balance for op in part])
+            chunk.time.extend([op.time for op in part])
+            first = chunk.first_item
+            end = first[-1]
+            for op in part:
+                if op.items:
+                    for item in op.items:
+                        chunk.name.append(intern(item.name))
+                        chunk.item_type.append(intern(item.item_type))
+                        chunk.price.append(item.price)
+                        chunk.count.append(item.count)
+                    end += len(op.items)
+                first.append(end)
+            done += len(part)
+            self.starts[-1] += len(part)
+
+    def prepend(self, operations):
+        # A log whose string ids agree with this one (older rows of the same binary file)
+        # is spliced in chunk by chunk; anything else is interned into new chunks.
+        if isinstance(operations, OperationLog) and operations.strings == self.strings[:len(operations.strings)]:
+            chunks = operations.chunks
+        else:
+            older = OperationLog.__new__(OperationLog)
+            older.strings, older.string_ids, older.chunks, older.starts, older.shared = self.strings, self.string_ids, [], [0], set()
+            older.offsets = Fenwick()
+            older.extend(operations)
+            chunks = older.chunks
+        self.chunks[:0] = chunks
+        self.offsets = Fenwick([0] * len(chunks) + self.offsets.values())
+        self.reindex()
+
+    def reindex(self):
+        self.starts = [0]
+        for chunk in self.chunks:
+            self.starts.append(self.starts[-1] + len(chunk))
+
+    def position(self, index):
+        # (chunk index, row) of operation `index`.
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("operation index out of range")
+        c = bisect_right(self.starts, index) - 1
+        return c, index - self.starts[c]
+
+    def locate(self, index):
+        c, j = self.position(index)
+        return self.chunks[c], j
+
+    def offset(self, c):
+        return self.offsets.prefix(c + 1)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        c, j = self.position(index)
+        op = self.chunks[c].get(j, self.strings)
+        op.balance += self.offset(c)
+        return op
+
+    def __iter__(self):
+        for c, chunk in enumerate(self.chunks):
+            offset = self.offset(c)
+            for j in range(len(chunk)):
+                op = chunk.get(j, self.strings)
+                op.balance += offset
+                yield op
+
+    def __reversed__(self):
+        for c in range(len(self.chunks) - 1, -1, -1):
+            chunk, offset = self.chunks[c], self.offset(c)
+            for j in range(len(chunk) - 1, -1, -1):
+                op = chunk.get(j, self.strings)
+                op.balance += offset
+                yield op
+
+    def locate_writable(self, index):
+        c, j = self.position(index)
+        return self.writable(c), j
+
+    def replace(self, index, op):
+        c, j = self.position(index)
+        chunk = self.writable(c)
+        chunk.replace(j, op, self.intern)
+        chunk.balance[j] -= self.offset(c)
+
+    def delete(self, index):
+        c, j = self.position(index)
+        chunk = self.writable(c)
+        chunk.delete(j)
+        if not len(chunk):
+            # The next chunk takes over this one's difference, keeping its own offset.
+            values = self.offsets.values()
+            if c + 1 < len(values):
+                values[c + 1] += values[c]
+            del values[c]
+            del self.chunks[c]
+            self.offsets = Fenwick(values)
+            self.reindex()
+            if self.chunks:
+                self.settle(len(self.chunks) - 1)
+            return
+        self.reindex()
+
+    def settle(self, c=None):
+        # Folds the offset of chunk c (or of every chunk) into its balance column.
+        for c in range(len(self.chunks)) if c is None else [c]:
+            offset = self.offset(c)
+            if offset:
+                np.frombuffer(self.writable(c).balance, dtype=np.int64)[:] += offset
+                self.offsets.add(c, -offset)
+                if c + 1 < len(self.chunks):
+                    self.offsets.add(c + 1, offset)
+
+    def truncate(self, index):
+        # Drops operations index: and returns them.
+        self.settle()
+        tail = self[index:]
+        if index < len(self):
+            c = bisect_right(self.starts, index) - 1
+            j = index - self.starts[c]
+            del self.chunks[c + 1:]
+            if j:
+                self.writable(c).truncate(j)
+            else:
+                del self.chunks[c]
+            self.offsets = Fenwick([0] * len(self.chunks))
+            self.reindex()
+        return tail
+
+    def adjust_amount(self, index, delta):
+        chunk, j = self.locate_writable(index)
+        chunk.amount[j] += delta
+
+    def balance(self, index):
+        c, j = self.position(index)
+        return self.chunks[c].balance[j] + self.offset(c)
+
+    def kind_ids(self):
+        return self.string_ids.get("Purchase", -1), self.string_ids.get("Set balance", -1)
+
+    def bisect_time(self, time, right=True):
+        # Number of operations at or before `time` (strictly before if not `right`);
+        # history is kept in chronological order, so this is two binary searches.
+        lo, hi = 0, len(self.chunks)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            first = self.chunks[mid].time[0]
+            if first < time or right and first == time:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return 0
+        times = self.chunks[lo - 1].time
+        return self.starts[lo - 1] + (bisect_right(times, time) if right else bisect_left(times, time))
+
+    def spans(self, start, stop):
+        # (chunk index, a, b) covering positions start:stop.
+        for c in range(max(bisect_right(self.starts, start) - 1, 0), len(self.chunks)):
+            if self.starts[c] >= stop:
+                break
+            yield c, max(start - self.starts[c], 0), min(stop, self.starts[c + 1]) - self.starts[c]
+
+    def shift_balances(self, start, stop, delta):
+        # Balances start:stop move by delta: partly covered chunks (and the last chunk) in
+        # place, the whole chunks between them through the offset tree.
+        if not delta or start >= stop:
+            return
+        first = bisect_right(self.starts, start) - 1
+        last = bisect_right(self.starts, stop - 1) - 1
+        lo, hi = first, last + 1
+        if start > self.starts[first] or first == len(self.chunks) - 1:
+            end = min(stop, self.starts[first + 1]) - self.starts[first]
+            np.frombuffer(self.writable(first).balance, dtype=np.int64)[start - self.starts[first]:end] += delta
+            lo += 1
+        if last >= lo and (stop < self.starts[last + 1] or last == len(self.chunks) - 1):
+            np.frombuffer(self.writable(last).balance, dtype=np.int64)[:stop - self.starts[last]] += delta
+            hi -= 1
+        if hi > lo:
+            self.offsets.add(lo, delta)
+            self.offsets.add(hi, -delta)
+
+    def column(self, name, start, stop):
+        # One column over positions start:stop as a contiguous NumPy array.
+        dtype = np.uint32 if name == "kind" else np.int64
+        spans = list(self.spans(start, stop))
+        parts = [np.frombuffer(getattr(self.chunks[c], name), dtype=dtype)[a:b] for c, a, b in spans]
+        if name == "balance":
+            parts = [part + self.offset(c) for part, (c, a, b) in zip(parts, spans)]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+
+    def purchase_items(self, start=0, stop=None):
+        # Item rows of the purchases in start:stop as arrays: day ordinal, name id, type
+        # id, count and price.
+        stop = len(self) if stop is None else stop
+        purchase = self.string_ids.get("Purchase")
+        parts = []
+        if purchase is None:
+            return tuple(np.zeros(0, dtype=np.int64) for _ in range(5))
+        for c, a, b in self.spans(start, stop):
+            chunk = self.chunks[c]
+            first = np.frombuffer(chunk.first_item, dtype=np.uint32)
+            owner = np.repeat(np.arange(a, b), np.diff(first[a:b + 1]))
+            keep = np.frombuffer(chunk.kind, dtype=np.uint32)[owner] == purchase
+            rows = slice(int(first[a]), int(first[b]))
+            parts.append((np.frombuffer(chunk.time, dtype=np.int64)[owner][keep] // DAY_MICROS + EPOCH_DAY,
+                          np.frombuffer(chunk.name, dtype=np.uint32)[rows][keep],
+                          np.frombuffer(chunk.item_type, dtype=np.uint32)[rows][keep],
+                          np.frombuffer(chunk.count, dtype=np.int32)[rows][keep].astype(np.int64),
+                          np.frombuffer(chunk.price, dtype=np.int64)[rows][keep]))
+        if not parts:
+            return tuple(np.zeros(0, dtype=np.int64) for _ in range(5))
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    def verify_balances(self, balance=0):
+        # Recomputes every running balance from amounts, chunk by chunk in NumPy, and
+        # returns the positions whose stored balance (or Set balance amount) disagrees.
+        self.settle()
+        purchase, reset = self.kind_ids()
+        bad = []
+        for start, chunk in zip(self.starts, self.chunks):
+            stored = np.frombuffer(chunk.balance, dtype=np.int64)
+            resets = np.frombuffer(chunk.kind, dtype=np.uint32) == reset
+            running = np.cumsum(chunk.flows(purchase, reset))
+            last = np.maximum.accumulate(np.where(resets, np.arange(len(chunk)), -1))
+            expected = np.where(last >= 0, (stored - running)[last] + running, balance + running)
+            before = np.concatenate(([balance], expected[:-1]))
+            amounts = np.frombuffer(chunk.amount, dtype=np.int64)
+            wrong = (stored != expected) | resets & (amounts != stored - before)
+            bad.extend((start + np.flatnonzero(wrong)).tolist())
+            balance = int(expected[-1])
+        return bad
+
+    def rows(self):
+        # (kind, amount, balance, time) without materializing items, for bulk scans.
+        strings = self.strings
+        for c, chunk in enumerate(self.chunks):
+            offset = self.offset(c)
+            for kind, amount, balance, time in zip(chunk.kind, chunk.amount, chunk.balance, chunk.time):
+                yield strings[kind], amount, balance + offset, time
+
+    def recompute_balances(self, balance=0, start=0):
+        # Purchases subtract, everything else adds; a "Set balance" keeps its absolute
+        # balance and has its amount re-derived as the correction it represents.
+        # `balance` is the balance before position `start`.
+        self.settle()
+        purchase = self.string_ids.get("Purchase")
+        reset = self.string_ids.get("Set balance")
+        changed = 0
+        first = max(bisect_right(self.starts, start) - 1, 0)
+        for c in range(first, len(self.chunks)):
+            chunk = self.writable(c)
+            kinds, amounts, balances = chunk.kind, chunk.amount, chunk.balance
+            for j in range(start - self.starts[c] if c == first else 0, len(kinds)):
+                if kinds[j] == reset:
+                    if amounts[j] != balances[j] - balance:
+                        amounts[j] = balances[j] - balance
+                        changed += 1
+                    balance = balances[j]
+                    continue
+                balance += -amounts[j] if kinds[j] == purchase else amounts[j]
+                if balances[j] != balance:
+                    balances[j] = balance
+                    changed += 1
+        return balance, changed
+
+def group_sums(keys, *values):
+    # Distinct keys and the integer sums of each value array per key.
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return (keys[starts],) + tuple(np.add.reduceat(value[order], starts) for value in values)
+
+
+def decode_lines(lines):
+    # One JSON array from lines holding an element each, with or without trailing commas.
+    return json.loads(b"[" + b",".join(line.rstrip().rstrip(b",") for line in lines) + b"]")
+
+
+def iter_lines_backward(f, start, end, block=1 << 16):
+    # Yields (offset, line) for the binary file f between start and end, last line first.
+    pos = end
+    rest = b""
+    while pos > start:
+        size = min(block, pos - start)
+        pos -= size
+        f.seek(pos)
+        chunk = f.read(size) + rest
+        lines = chunk.split(b"\n")
+        line_end = pos + len(chunk)
+        for i in range(len(lines) - 1, 0, -1):
+            line_start = line_end - len(lines[i])
+            if lines[i].strip():
+                yield line_start, lines[i]
+            line_end = line_start - 1
+        rest = lines[0]
+    if rest.strip():
+        yield start, rest
+
+
+class Catalog:
+    # Known products keyed by name and item types as an ordered set. The sorted lists fed
+    # to the comboboxes are cached and kept sorted by insertion when a new entry arrives.
+    def __init__(self, items=(), types=()):
+        self.items = {}
+        self.types = dict.fromkeys(types)
+        self.sorted_names = None
+        self.sorted_types = None
+        self.version = 0
+        for item in items:
+            self.add(item)
+
+    def get(self, name):
+        return self.items.get(name)
+
+    def add_type(self, item_type):
+        if item_type in self.types:
+            return False
+        self.types[item_type] = None
+        if self.sorted_types is not None:
+            insort(self.sorted_types, item_type, key=str.lower)
+        self.version += 1
+        return True
+
+    def add(self, item):
+        new_type = self.add_type(item.item_type)
+        known = self.items.get(item.name)
+        new_name = known is None
+        if new_name:
+            self.items[item.name] = Item(item.name, item.item_type, item.price)
+            if self.sorted_names is not None:
+                insort(self.sorted_names, item.name, key=str.lower)
+            changed = True
+        else:
+            changed = known.item_type != item.item_type or known.price != item.price
+            known.item_type = item.item_type
+            known.price = item.price
+        if new_type or changed:
+            self.version += 1
+        return new_type, new_name, changed
+
+    def names(self):
+        if self.sorted_names is None:
+            self.sorted_names = sorted(self.items, key=str.lower)
+        return self.sorted_names
+
+    def type_names(self):
+        if self.sorted_types is None:
+            self.sorted_types = sorted(self.types, key=str.lower)
+        return self.sorted_types
+
+
+class ItemRollup:
+    # Per-item purchase buckets: count and spend (cents) per calendar day, held as NumPy
+    # columns sorted by item id << DAY_BITS | day, plus per-item totals. Single purchases
+    # wait in `pending` until the next window query folds them in; windows are then two
+    # searchsorted lookups per item into prefix sums of the columns.
+    WINDOWS = (7, 30, 365)
+    DAY_BITS = 20  # day ordinals stay below 2**20 until the year 2870
+
+    def __init__(self):
+        self.version = 0
+        self.clear()
+
+    def clear(self):
+        self.ids = {}
+        self.names = []
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.spends = np.zeros(0, dtype=np.int64)
+        self.cumulative = None
+        self.pending = {}
+        self.totals = {}
+        self.windows = {}
+        self.windows_for = None
+
+    def rebuild(self, log):
+        self.clear()
+        self.add_log(log)
+
+    def item_id(self, name):
+        item_id = self.ids.get(name)
+        if item_id is None:
+            item_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return item_id
+
+    def add_log(self, log, start=0, stop=None):
+        # Bulk path for whole histories and loader batches: item rows come straight from
+        # the log's columns and are summed per (item, day) before merging.
+        days, names, _, counts, prices = log.purchase_items(start, stop)
+        self.version += 1
+        if not len(days):
+            return
+        string_ids, inverse = np.unique(names, return_inverse=True)
+        item_ids = np.array([self.item_id(log.strings[i]) for i in string_ids.tolist()], dtype=np.int64)
+        item_ids = item_ids[inverse.reshape(-1)]
+        spends = prices * counts
+        self.merge((item_ids << self.DAY_BITS) + days, counts, spends)
+        keys, counts, spends = group_sums(item_ids, counts, spends)
+        for item_id, count, spend in zip(keys.tolist(), counts.tolist(), spends.tolist()):
+            total = self.totals.setdefault(self.names[item_id], [0, 0])
+            total[0] += count
+            total[1] += spend
+
+    def add_operation(self, op, sign=1):
+        # sign=-1 takes an edited or deleted operation back out.
+        if op.kind != "Purchase":
+            return
+        self.version += 1
+        day = op.timestamp.date().toordinal()
+        for item in op.items:
+            count = sign * item.count
+            spend = item.price * count
+            bucket = self.pending.setdefault((self.item_id(item.name) << self.DAY_BITS) + day, [0, 0])
+            bucket[0] += count
+            bucket[1] += spend
+            total = self.totals.setdefault(item.name, [0, 0])
+            total[0] += count
+            total[1] += spend
+
+    def merge(self, keys, counts, spends):
+        self.keys, self.counts, self.spends = group_sums(np.concatenate((self.keys, keys)),
+                                                         np.concatenate((self.counts, counts)),
+                                                         np.concatenate((self.spends, spends)))
+        self.cumulative = None
+
+    def flush(self):
+        if self.pending:
+            keys = np.fromiter(self.pending, dtype=np.int64, count=len(self.pending))
+            values = np.array(list(self.pending.values()), dtype=np.int64)
+            self.pending = {}
+            self.merge(keys, values[:, 0], values[:, 1])
+        if self.cumulative is None:
+            self.cumulative = (np.r_[0, np.cumsum(self.counts)], np.r_[0, np.cumsum(self.spends)])
+
+    def window_totals(self, name, today=None):
+        # All items' windows are computed together once per (today, version).
+        today = (today or datetime.now().date()).toordinal()
+        if self.windows_for != (today, self.version):
+            self.flush()
+            counts, spends = self.cumulative
+            base = np.arange(len(self.names), dtype=np.int64) << self.DAY_BITS
+            stop = np.searchsorted(self.keys, base + today + 1)
+            columns = []
+            for length in self.WINDOWS:
+                start = np.searchsorted(self.keys, base + max(today - length + 1, 0))
+                columns += [counts[stop] - counts[start], spends[stop] - spends[start]]
+            rows = np.stack(columns, axis=1).tolist()
+            self.windows = {name: [row[i:i + 2] for i in range(0, len(row), 2)]
+                            for name, row in zip(self.names, rows)}
+            self.windows_for = (today, self.version)
+        return self.windows.get(name) or [[0, 0] for _ in self.WINDOWS]
+
+    def total(self, name):
+        return self.totals.get(name, [0, 0])
+
+
+class TypeSpend:
+    # Purchase spend (cents) per item type per calendar day. `version` changes on every
+    # update so views can tell whether a redraw is needed.
+    def __init__(self):
+        self.days = {}
+        self.totals = {}
+        self.version = 0
+
+    def rebuild(self, log):
+        self.days = {}
+        self.totals = {}
+        self.add_log(log)
+
+    def add_log(self, log, start=0, stop=None):
+        days, _, types, counts, prices = log.purchase_items(start, stop)
+        self.version += 1
+        if not len(days):
+            return
+        width = len(log.strings)
+        keys, spends = group_sums(days * width + types, prices * counts)
+        strings = log.strings
+        for key, spend in zip(keys.tolist(), spends.tolist()):
+            item_type = strings[key % width]
+            day = self.days.setdefault(key // width, {})
+            day[item_type] = day.get(item_type, 0) + spend
+            self.totals[item_type] = self.totals.get(item_type, 0) + spend
+
+    def add_operation(self, op, sign=1):
+        if op.kind != "Purchase":
+            return
+        day = self.days.setdefault(op.timestamp.date().toordinal(), {})
+        for item in op.items:
+            spend = sign * item.price * item.count
+            day[item.item_type] = day.get(item.item_type, 0) + spend
+            self.totals[item.item_type] = self.totals.get(item.item_type, 0) + spend
+        self.version += 1
+
+    def spend_since(self, start=None):
+        if start is None:
+            return dict(self.totals)
+        start = start.toordinal()
+        result = {}
+        for day, types in self.days.items():
+            if day >= start:
+                for item_type, spend in types.items():
+                    result[item_type] = result.get(item_type, 0) + spend
+        return result
+
+
+class BalanceSeries:
+    # Times as a flat float array (matplotlib date numbers) that mirrors the operations
+    # log and follows it through ledger events. Balances are read from the log for the
+    # drawn range only, so edits that move later balances cost nothing here.
+    def __init__(self, operations):
+        self.operations = operations
+        self.x = array("d")
+        self.version = 0
+
+    def rebuild(self, operations):
+        self.operations = operations
+        self.x = array("d", (operations.column("time", 0, len(operations)) / 86400e6).tobytes())
+        self.version += 1
+
+    def insert(self, index, operations):
+        self.x[index:index] = array("d", [op.time / 86400e6 for op in operations])
+        self.version += 1
+
+    def insert_log(self, log, start, stop):
+        # Positions start:stop of the log were just inserted; read them from the columns.
+        self.x[start:start] = array("d", (log.column("time", start, stop) / 86400e6).tobytes())
+        self.version += 1
+
+    def replace(self, index, op):
+        self.x[index] = op.time / 86400e6
+        self.version += 1
+
+    def remove(self, index):
+        del self.x[index]
+        self.version += 1
+
+    def refresh(self):
+        # Balances moved after an edit.
+        self.version += 1
+
+    def visible(self, xmin, xmax, width):
+        x = np.frombuffer(self.x, dtype=np.float64)
+        lo = max(0, int(np.searchsorted(x, xmin)) - 1)
+        hi = min(len(x), int(np.searchsorted(x, xmax, side="right")) + 1)
+        return downsample_minmax(x[lo:hi], self.operations.column("balance", lo, hi) / 100, width)
+
+
+class Fenwick:
+    # Binary indexed tree: point add and prefix sum in O(log n), and it can grow.
+    def __init__(self, values=()):
+        self.tree = []
+        for value in values:
+            self.append(value)
+
+    def __len__(self):
+        return len(self.tree)
+
+    def append(self, value):
+        i = len(self.tree) + 1
+        self.tree.append(value + self.prefix(i - 1) - self.prefix(i - (i & -i)))
+
+    def add(self, i, delta):
+        i += 1
+        while i <= len(self.tree):
+            self.tree[i - 1] += delta
+            i += i & -i
+
+    def prefix(self, i):
+        # Sum of the first i values.
+        total = 0
+        while i > 0:
+            total += self.tree[i - 1]
+            i -= i & -i
+        return total
+
+    def search(self, total):
+        # Smallest i with prefix(i + 1) >= total, or len(self); values must not be negative.
+        i, step = 0, 1 << len(self.tree).bit_length()
+        while step:
+            if i + step <= len(self.tree) and self.tree[i + step - 1] < total:
+                i += step
+                total -= self.tree[i - 1]
+            step >>= 1
+        return i
+
+    def values(self):
+        return [self.prefix(i + 1) - self.prefix(i) for i in range(len(self.tree))]
+
+    def copy(self):
+        copy = Fenwick()
+        copy.tree = list(self.tree)
+        return copy
+
+
+class BalanceIndex:
+    # Checkpoint index over integer-cent flows: a Fenwick tree of per-chunk flow totals,
+    # so the flow before any position is O(log chunks) plus one vectorized partial chunk.
+    # A second tree counts "Set balance" operations per chunk to find the next one.
+    def __init__(self, operations):
+        self.operations = operations
+        self.tree = Fenwick()
+        self.resets = Fenwick()
+
+    def rebuild(self, operations):
+        self.operations = operations
+        purchase, reset = operations.kind_ids()
+        self.tree = Fenwick(int(chunk.flows(purchase, reset).sum()) for chunk in operations.chunks)
+        self.resets = Fenwick(int(np.count_nonzero(np.frombuffer(chunk.kind, dtype=np.uint32) == reset))
+                              for chunk in operations.chunks)
+
+    def insert(self, index, ops):
+        # Appended operations are added to their chunk totals; older history changes
+        # every chunk position, so it rebuilds.
+        if index < len(self.operations) - len(ops):
+            self.rebuild(self.operations)
+            return
+        log = self.operations
+        kinds = log.kind_ids()
+        for c, a, b in log.spans(index, index + len(ops)):
+            while len(self.tree) <= c:
+                self.tree.append(0)
+                self.resets.append(0)
+            self.tree.add(c, int(log.chunks[c].flows(*kinds)[a:b].sum()))
+            self.resets.add(c, int(np.count_nonzero(np.frombuffer(log.chunks[c].kind, dtype=np.uint32)[a:b] == kinds[1])))
+
+    def update(self, index, delta, resets=0):
+        self.add(bisect_right(self.operations.starts, index) - 1, delta, resets)
+
+    def add(self, c, delta, resets=0):
+        # Chunk c's flow changed by delta and its "Set balance" count by resets.
+        if delta:
+            self.tree.add(c, delta)
+        if resets:
+            self.resets.add(c, resets)
+
+    def next_reset(self, index):
+        # Position of the first "Set balance" after `index`, or len(log): the rest of its
+        # chunk is one vectorized scan, later chunks one descent of the reset tree.
+        log = self.operations
+        reset = log.kind_ids()[1]
+        start = index + 1
+        if start >= len(log):
+            return len(log)
+        c = bisect_right(log.starts, start) - 1
+        hits = np.flatnonzero(np.frombuffer(log.chunks[c].kind, dtype=np.uint32)[start - log.starts[c]:] == reset)
+        if len(hits):
+            return start + int(hits[0])
+        c = self.resets.search(self.resets.prefix(c + 1) + 1)
+        if c >= len(log.chunks):
+            return len(log)
+        return log.starts[c] + int(np.flatnonzero(np.frombuffer(log.chunks[c].kind, dtype=np.uint32) == reset)[0])
+
+    def flow_before(self, index):
+        log = self.operations
+        if index >= len(log):
+            return self.tree.prefix(len(self.tree))
+        c = bisect_right(log.starts, index) - 1
+        partial = log.chunks[c].flows(*log.kind_ids())[:index - log.starts[c]].sum()
+        return self.tree.prefix(c) + int(partial)
+
+    def net_flow(self, start=None, end=None):
+        # Income minus spending of operations with start <= time < end; balance
+        # corrections are not flows.
+        log = self.operations
+        a = log.bisect_time(to_micros(start), right=False) if start else 0
+        b = log.bisect_time(to_micros(end), right=False) if end else len(log)
+        return self.flow_before(b) - self.flow_before(a) if b > a else 0
+
+
+class HistoryIndex:
+    # Inverted index from item name and type string ids to the positions of operations
+    # that contain them. It is built on the first search after anything but an append,
+    # appends are collected in `pending` and merged on the next lookup.
+    def __init__(self, operations):
+        self.operations = operations
+        self.postings = None
+        self.pending = {}
+        self.lowered = []
+
+    def invalidate(self):
+        self.postings = None
+        self.pending = {}
+
+    def insert(self, index, ops):
+        if self.postings is None:
+            return
+        if index < len(self.operations) - len(ops):
+            self.invalidate()
+            return
+        ids = self.operations.string_ids
+        for pos, op in enumerate(ops, index):
+            for sid in {ids[item.name] for item in op.items} | {ids[item.item_type] for item in op.items}:
+                self.pending.setdefault(sid, []).append(pos)
+
+    def rebuild(self):
+        log = self.operations
+        positions, ids = [], []
+        for start, chunk in zip(log.starts, log.chunks):
+            owners = np.repeat(np.arange(start, start + len(chunk)), np.diff(np.frombuffer(chunk.first_item, dtype=np.uint32)))
+            positions += [owners, owners]
+            ids += [np.frombuffer(chunk.name, dtype=np.uint32), np.frombuffer(chunk.item_type, dtype=np.uint32)]
+        self.postings = {}
+        self.pending = {}
+        if not positions:
+            return
+        ids = np.concatenate(ids)
+        if not len(ids):
+            return  # operations, but none with items
+        order = np.argsort(ids, kind="stable")
+        ids = ids[order]
+        positions = np.concatenate(positions)[order]
+        bounds = np.flatnonzero(np.diff(ids)) + 1
+        for sid, group in zip(ids[np.concatenate(([0], bounds))].tolist(), np.split(positions, bounds)):
+            self.postings[sid] = group
+
+    def lookup(self, text):
+        # Positions (possibly repeated) of operations with an item name or type containing text.
+        if self.postings is None:
+            self.rebuild()
+        for sid, positions in self.pending.items():
+            self.postings[sid] = np.concatenate((self.postings.get(sid, np.zeros(0, dtype=np.int64)), positions))
+        self.pending = {}
+        strings = self.operations.strings
+        self.lowered += [value.lower() for value in strings[len(self.lowered):]]
+        text = text.lower()
+        parts = [self.postings[sid] for sid, value in enumerate(self.lowered) if text in value and sid in self.postings]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+
+class SearchResult:
+    # Read-only list of the operations at `positions`, for HistoryView.
+    def __init__(self, operations, positions):
+        self.operations = operations
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        return self.operations[int(self.positions[index])]
+
+    def shift(self, index, count):
+        # `count` operations were inserted at `index`; matches from there on move back.
+        self.positions = self.positions + count * (self.positions >= index)
+
+
+def op_flow(op):
+    if op.kind == "Set balance":
+        return 0
+    return -op.amount if op.kind == "Purchase" else op.amount
+
+
+def downsample_minmax(x, y, width):
+    # Keeps the first, last, lowest and highest point of each of `width` buckets, in
+    # their original order, so spikes survive and the output size depends on the screen.
+    n = len(x)
+    width = max(1, int(width))
+    if n <= 4 * width:
+        return x.copy(), y.copy()
+    size = -(-n // width)
+    padded = np.concatenate([y, np.full(width * size - n, y[-1])]).reshape(width, size)
+    base = np.arange(width) * size
+    picks = np.stack([base, base + padded.argmin(axis=1), base + padded.argmax(axis=1),
+                      base + size - 1], axis=1)
+    picks = np.unique(np.minimum(picks, n - 1))
+    return x[picks], y[picks]
+
+
+class JsonStore:
+    # The file is one JSON object laid out in lines: balance, basket and catalog on the
+    # first line up to `"history":[`, then one operation per line, then `]}`. JSON
+    # strings cannot hold a raw newline, so the recent operations are read from the end
+    # of the file and the older ones are decoded a batch at a time on the loader thread.
+    complete = True
+    incremental = False  # True when every change is written as it happens
+    compact_due = False  # True when an incremental store wants a snapshot written
+    outdated = False  # True when the file should be saved again in the current layout
+
+    def __init__(self, path=DATA_FILE):
+        self.path = path
+        self.older = []
+        self.older_range = None
+
+    def load(self):
+        state = self.load_head(None)
+        if state is not None:
+            for batch in self.iter_older():
+                state["history"][:0] = batch
+            self.complete = True
+        return state
+
+    def load_head(self, recent):
+        if not os.path.exists(self.path):
+            return None
+        self.older, self.older_range = [], None
+        with open(self.path, "rb") as f:
+            first = f.readline().rstrip()
+            if not first.endswith(b'"history":['):
+                return self.load_whole(f, recent)
+            data = json.loads(first + b"]}")
+            start = f.tell()
+            end = f.seek(0, os.SEEK_END)
+            lines = iter_lines_backward(f, start, end)
+            offset, last = next(lines, (start, b"]}"))
+            # Keys written after the history, as in older files, are on its closing line.
+            if last.strip() != b"]}":
+                data.update(json.loads(b"{" + last.strip()[2:]))
+            history = []
+            boundary = offset
+            for offset, line in lines:
+                if recent is not None and len(history) >= recent:
+                    break
+                history.append(line)
+                boundary = offset
+        history.reverse()
+        self.older_range = (start, boundary) if boundary > start else None
+        self.complete = self.older_range is None
+        return self.head_state(data, [Operation.from_dict(op) for op in decode_lines(history)])
+
+    def load_whole(self, f, recent):
+        # A file from before the line layout is decoded in one go, once; marking it
+        # outdated makes the next save write it in the current layout.
+        f.seek(0)
+        data = json.load(f)
+        history = data.get("history", [])
+        split = 0 if recent is None else max(0, len(history) - recent)
+        self.older = history[:split]
+        self.complete = not self.older
+        self.outdated = True
+        return self.head_state(data, [Operation.from_dict(op) for op in history[split:]])
+
+    def head_state(self, data, history):
+        return {
+            "balance": data.get("balance", 0),
+            "item_list": [Item(**item) for item in data.get("item_list", [])],
+            "item_types": data.get("item_types", []),
+            "items": [Item(**item) for item in data.get("items", [])],
+            "history": history
+        }
+
+    def iter_older(self, batch=LOAD_BATCH):
+        # Batches come newest first, each batch in chronological order.
+        older, self.older = self.older, []
+        for end in range(len(older), 0, -batch):
+            yield [Operation.from_dict(op) for op in older[max(0, end - batch):end]]
+        if self.older_range is None:
+            return
+        start, end = self.older_range
+        self.older_range = None
+        lines = []
+        with open(self.path, "rb") as f:
+            for offset, line in iter_lines_backward(f, start, end):
+                lines.append(line)
+                if len(lines) >= batch:
+                    lines.reverse()
+                    yield [Operation.from_dict(op) for op in decode_lines(lines)]
+                    lines = []
+        if lines:
+            lines.reverse()
+            yield [Operation.from_dict(op) for op in decode_lines(lines)]
+
+    def save(self, state):
+        # Written compactly: json.dump with indent falls back to the pure-Python encoder.
+        # The temp file and rename keep the old ledger intact if a save is cut short.
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            head = compact_json({
+                "balance": state["balance"],
+                "item_list": [item.to_dict() for item in state["item_list"]],
+                "item_types": [item for item in state["item_types"]],
+                "items": [item.to_dict() for item in state["items"]],
+                "history": []
+            })
+            f.write(head[:-2] + "\n")
+            separator = ""
+            for op in state["history"]:
+                f.write(separator + compact_json(op.to_dict()))
+                separator = ",\n"
+            f.write("\n]}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.outdated = False
+
+    def record_operation(self, op, balance):
+        pass
+
+    def record_operations(self, ops, balance):
+        for op in ops:
+            self.record_operation(op, op.balance)
+
+    def rewrite(self, state):
+        # Edited history reaches the file with the next save, like new operations do.
+        pass
+
+    def record_edit(self, index, op, stop, delta, state):
+        # Operation `index` became `op`; balances index + 1:stop moved by delta, which the
+        # "Set balance" at `stop` absorbed if there is one.
+        self.rewrite(state)
+
+    def record_delete(self, index, stop, delta, state):
+        # Operation `index` was removed; balances index:stop moved by delta, as above.
+        self.rewrite(state)
+
+    def checkpoint(self, state):
+        self.save(state)
+
+    def begin_snapshot(self, state):
+        # Runs on the Tk thread as a snapshot for save_snapshot() is taken.
+        pass
+
+    def save_snapshot(self, state):
+        # Runs on the autosave worker.
+        self.save(state)
+
+    def record_item(self, item):
+        pass
+
+    def record_type(self, item_type):
+        pass
+
+    def detach(self):
+        # Drops open files and connections; they are reopened on the next write.
+        pass
+
+    def close(self, state):
+        self.save(state)
+
+
+class JournalStore(JsonStore):
+    # Snapshot is JSON lines: a header with balance/catalog, then one operation per line.
+    # Every mutation is appended to the log; once the log grows past half the snapshot
+    # size it is rotated and a new snapshot is written from a ledger snapshot on the
+    # autosave worker, so compaction stays amortized O(1) per operation and off the Tk
+    # thread. A snapshot of generation g covers every log of generation below g.
+    incremental = True
+    snapshot_lock = threading.Lock()  # the autosave worker and an exit-time compaction can both write a snapshot
+
+    def __init__(self, snapshot_path=SNAPSHOT_FILE, log_path=JOURNAL_FILE, legacy_path=DATA_FILE):
+        super().__init__(legacy_path)
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.generation = 0
+        self.snapshot_count = 0
+        self.log_count = 0
+        self.log = None
+        self.state = None
+        self.older_range = None
+        self.written = 0
+
+    @property
+    def compact_due(self):
+        return self.complete and self.log_count > max(COMPACT_MIN_RECORDS, self.snapshot_count // 2)
+
+    def rotated_path(self, generation):
+        return "%s.%d" % (self.log_path, generation)
+
+    def load_head(self, recent):
+        # Edit and delete records can reach any operation, so a log holding them means
+        # the whole snapshot is loaded before replaying.
+        if not os.path.exists(self.snapshot_path):
+            state = JsonStore(self.path).load()
+            if state is not None:
+                self.state = state
+                self.compact()
+                return state
+            if not os.path.exists(self.log_path):
+                return None
+            # A ledger started in journal mode has only a generation-0 log until its
+            # first compaction.
+            self.generation = self.snapshot_count = self.written = 0
+            state = {"balance": 0, "item_list": [], "item_types": [], "items": [], "history": []}
+            self.replay(state)
+            self.state = state
+            return state
+        with open(self.snapshot_path, "rb") as f:
+            header = json.loads(f.readline())
+            if recent is not None and self.log_has_edits(header.get("generation", 0)):
+                recent = None
+            start = f.tell()
+            end = f.seek(0, os.SEEK_END)
+            history = []
+            if recent is None:
+                boundary = start
+            else:
+                boundary = end
+                for offset, line in iter_lines_backward(f, start, end):
+                    if len(history) >= recent:
+                        break
+                    history.append(line)
+                    boundary = offset
+                history.reverse()
+            if recent is None:
+                f.seek(start)
+                history = [line for line in f if line.strip()]
+        history = [Operation.from_dict(json.loads(line)) for line in history]
+        self.generation = self.written = header.get("generation", 0)
+        self.snapshot_count = header.get("count", len(history))
+        self.older_range = (start, boundary) if boundary > start else None
+        self.complete = self.older_range is None
+        state = {
+            "balance": header.get("balance", 0),
+            "item_list": [Item(**item) for item in header.get("item_list", [])],
+            "item_types": header.get("item_types", []),
+            "items": [Item(**item) for item in header.get("items", [])],
+            "history": history
+        }
+        self.replay(state)
+        self.state = state
+        return state
+
+    def iter_older(self, batch=LOAD_BATCH):
+        if self.older_range is None:
+            return
+        start, end = self.older_range
+        self.older_range = None
+        chunk = []
+        with open(self.snapshot_path, "rb") as f:
+            for offset, line in iter_lines_backward(f, start, end):
+                chunk.append(line)
+                if len(chunk) >= batch:
+                    yield [Operation.from_dict(json.loads(line)) for line in reversed(chunk)]
+                    chunk = []
+        if chunk:
+            yield [Operation.from_dict(json.loads(line)) for line in reversed(chunk)]
+
+    def log_has_edits(self, generation):
+        paths = [self.log_path]
+        while os.path.exists(self.rotated_path(generation)):
+            paths.append(self.rotated_path(generation))
+            generation += 1
+        for path in paths:
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    data = f.read()
+                if b'"t":"edit"' in data or b'"t":"delete"' in data:
+                    return True
+        return False
+
+    def replay(self, state):
+        # Rotated logs a snapshot has not covered yet come first, oldest first, then the
+        # live log; self.generation ends up as the live log's.
+        self.log_count = 0
+        items = {item.name: item for item in state["items"]}
+        while os.path.exists(self.rotated_path(self.generation)):
+            self.replay_file(self.rotated_path(self.generation), state, items)
+            self.generation += 1
+        if not self.replay_file(self.log_path, state, items) and os.path.exists(self.log_path):
+            # Left from an older generation: its records are in the snapshot already, and
+            # appending to it would lose new ones on the next load.
+            os.remove(self.log_path)
+
+    def replay_file(self, path, state, items):
+        if not os.path.exists(path):
+            return False
+        with open(path, "r") as f:
+            lines = f.readlines()
+        if not lines or json.loads(lines[0]).get("generation") != self.generation:
+            return False
+        for line in lines[1:]:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                break  # torn write at the tail, everything before it is intact
+            self.log_count += 1
+            if rec["t"] == "op":
+                state["history"].append(Operation.from_dict(rec["op"]))
+                state["balance"] = rec["balance"]
+            elif rec["t"] == "type":
+                if rec["name"] not in state["item_types"]:
+                    state["item_types"].append(rec["name"])
+            elif rec["t"] == "item":
+                item = Item(**rec["item"])
+                if item.name in items:
+                    items[item.name].item_type = item.item_type
+                    items[item.name].price = item.price
+                else:
+                    items[item.name] = item
+                    state["items"].append(item)
+            elif rec["t"] == "basket":
+                state["item_list"] = [Item(**i) for i in rec["items"]]
+            elif rec["t"] in ("edit", "delete"):
+                # Positions are counted from the end of the history after the change.
+                history = state["history"]
+                if rec["t"] == "edit":
+                    index = len(history) + rec["index"]
+                    history[index] = Operation.from_dict(rec["op"])
+                    index += 1
+                else:
+                    index = len(history) - 1 + rec["index"]
+                    del history[index]
+                stop = len(history) + rec["stop"]
+                for op in history[index:stop]:
+                    op.balance += rec["delta"]
+                if stop < len(history):
+                    history[stop].amount -= rec["delta"]
+                state["balance"] = rec["balance"]
+        return True
+
+    def open_log(self):
+        if self.log is None:
+            self.log = open(self.log_path, "a")
+            if self.log.tell() == 0:
+                self.log.write(json.dumps({"generation": self.generation}) + "\n")
+                self.log.flush()
+
+    def append(self, *recs):
+        self.open_log()
+        self.log.writelines(compact_json(rec) + "\n" for rec in recs)
+        self.log.flush()
+        self.log_count += len(recs)
+
+    def record_operation(self, op, balance):
+        self.state["balance"] = balance
+        self.append({"t": "op", "op": op.to_dict(), "balance": balance})
+
+    def record_operations(self, ops, balance):
+        self.state["balance"] = balance
+        self.append(*({"t": "op", "op": op.to_dict(), "balance": op.balance} for op in ops))
+
+    def record_edit(self, index, op, stop, delta, state):
+        self.state = state
+        n = len(state["history"])
+        self.append({"t": "edit", "index": index - n, "op": op.to_dict(), "stop": stop - n,
+                     "delta": delta, "balance": state["balance"]})
+
+    def record_delete(self, index, stop, delta, state):
+        self.state = state
+        n = len(state["history"])
+        self.append({"t": "delete", "index": index - n, "stop": stop - n,
+                     "delta": delta, "balance": state["balance"]})
+
+    def record_item(self, item):
+        self.append({"t": "item", "item": dict(item.to_dict(), count=1)})
+
+    def record_type(self, item_type):
+        self.append({"t": "type", "name": item_type})
+
+    def save(self, state):
+        self.state = state
+        if self.complete:
+            self.compact()
+
+    def rewrite(self, state):
+        self.save(state)
+
+    def checkpoint(self, state):
+        # Operations and catalog changes are already in the log; only the basket is not.
+        self.state = state
+        self.append({"t": "basket", "items": [item.to_dict() for item in state["item_list"]]})
+
+    def begin_snapshot(self, state):
+        state["generation"] = self.rotate(state)
+
+    def save_snapshot(self, state):
+        self.write_snapshot(state, state["generation"])
+
+    def compact(self):
+        self.write_snapshot(self.state, self.rotate(self.state))
+
+    def rotate(self, state):
+        # Everything logged so far is in `state`; the live log moves aside under its
+        # generation and later records go to a new one. Returns the snapshot generation.
+        self.open_log()
+        self.log.close()
+        self.log = None
+        os.replace(self.log_path, self.rotated_path(self.generation))
+        self.generation += 1
+        self.snapshot_count = len(state["history"])
+        self.log_count = 0
+        return self.generation
+
+    def write_snapshot(self, state, generation):
+        # Rotated logs are removed only once a snapshot covering them is in place, so a
+        # crash at any point leaves a snapshot plus the logs that follow it.
+        with self.snapshot_lock:
+            if generation <= self.written:
+                return
+            tmp = self.snapshot_path + ".tmp"
+            with open(tmp, "w") as f:
+                f.write(json.dumps({
+                    "generation": generation,
+                    "count": len(state["history"]),
+                    "balance": state["balance"],
+                    "item_list": [item.to_dict() for item in state["item_list"]],
+                    "item_types": list(state["item_types"]),
+                    "items": [item.to_dict() for item in state["items"]]
+                }) + "\n")
+                for op in state["history"]:
+                    f.write(compact_json(op.to_dict()) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.snapshot_path)
+            for g in range(self.written, generation):
+                if os.path.exists(self.rotated_path(g)):
+                    os.remove(self.rotated_path(g))
+            self.written = generation
+
+    def detach(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+    def close(self, state):
+        # A due compaction runs here when the app exits before an autosave picked it up.
+        self.checkpoint(state)
+        if self.compact_due:
+            self.compact()
+        self.detach()
+
+
+class SqliteStore(JsonStore):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS item_types (name TEXT PRIMARY KEY);
+        CREATE TABLE IF NOT EXISTS items (name TEXT PRIMARY KEY, item_type TEXT, price INTEGER);
+        CREATE TABLE IF NOT EXISTS operations (
+            id INTEGER PRIMARY KEY, kind TEXT, amount INTEGER, balance INTEGER, timestamp TEXT);
+        CREATE TABLE IF NOT EXISTS operation_items (
+            op_id INTEGER REFERENCES operations(id), name TEXT, item_type TEXT, price INTEGER, count INTEGER);
+        -- Rows with after_id < id < stop_id read delta more than their stored balance, so
+        -- an edit or delete adds one row here instead of updating every later balance.
+        CREATE TABLE IF NOT EXISTS balance_shifts (after_id INTEGER, stop_id INTEGER, delta INTEGER);
+        CREATE INDEX IF NOT EXISTS ix_operation_items_op ON operation_items(op_id);
+        -- Nothing queries by kind, time, name or type (the views read the ledger's
+        -- in-memory aggregates), so files from older versions drop those indexes.
+        DROP INDEX IF EXISTS ix_items_type;
+        DROP INDEX IF EXISTS ix_operations_timestamp;
+        DROP INDEX IF EXISTS ix_operations_kind;
+        DROP INDEX IF EXISTS ix_operation_items_name;
+        DROP INDEX IF EXISTS ix_operation_items_type;
+    """
+    incremental = True
+
+    def __init__(self, path=DB_FILE, legacy_path=DATA_FILE):
+        super().__init__(legacy_path)
+        self.db_path = path
+        self.db = None
+        self.state = None
+        self.oldest_loaded = None
+        # Row ids of the loaded operations in order. Older batches are prepended as they
+        # load, so ledger positions map to ids counting from the end.
+        self.ids = array("q")
+
+    def connect(self):
+        if self.db is None:
+            fresh = not os.path.exists(self.db_path)
+            self.db = sqlite3.connect(self.db_path)
+            self.db.executescript(self.SCHEMA)
+            if fresh and os.path.exists(self.path):
+                migrate_json_to_sqlite(self.path, self.db)
+        return self.db
+
+    def load_head(self, recent):
+        db = self.connect()
+        meta = dict(db.execute("SELECT key, value FROM meta"))
+        if not meta and not db.execute("SELECT 1 FROM operations LIMIT 1").fetchone():
+            return None
+        self.ids = array("q")
+        if recent is None:
+            history = self.query_operations("SELECT * FROM operations ORDER BY id", ids=self.ids)
+            self.oldest_loaded = None
+        else:
+            rows = db.execute("SELECT id FROM operations ORDER BY id DESC LIMIT ?", (recent,)).fetchall()
+            self.oldest_loaded = rows[-1][0] if rows else None
+            history = self.query_operations("SELECT * FROM operations WHERE id >= ? ORDER BY id", (self.oldest_loaded or 0,),
+                                            ids=self.ids)
+        self.complete = self.oldest_loaded is None
+        return {
+            "balance": int(meta.get("balance", 0)),
+            "item_list": [Item(**item) for item in json.loads(meta.get("item_list", "[]"))],
+            "item_types": [row[0] for row in db.execute("SELECT name FROM item_types ORDER BY rowid")],
+            "items": [Item(*row) for row in db.execute("SELECT name, item_type, price FROM items ORDER BY rowid")],
+            "history": history
+        }
+
+    def iter_older(self, batch=LOAD_BATCH):
+        if self.oldest_loaded is None:
+            return
+        # Runs on the loader thread, which needs its own connection.
+        db = sqlite3.connect(self.db_path)
+        before, self.oldest_loaded = self.oldest_loaded, None
+        try:
+            while True:
+                rows = db.execute("SELECT id FROM operations WHERE id < ? ORDER BY id DESC LIMIT ?", (before, batch)).fetchall()
+                if not rows:
+                    return
+                first, before = rows[-1][0], before
+                ids = array("q")
+                batch_ops = self.query_operations("SELECT * FROM operations WHERE id >= ? AND id < ? ORDER BY id", (first, before), db, ids)
+                self.ids[:0] = ids
+                yield batch_ops
+                before = first
+        finally:
+            db.close()
+
+    def query_operations(self, sql, args=(), db=None, ids=None):
+        db = db or self.connect()
+        rows = db.execute(sql, args).fetchall()
+        if ids is not None:
+            ids.extend(row[0] for row in rows)
+        if not rows:
+            return []
+        ops = {}
+        for op_id, kind, amount, balance, timestamp in rows:
+            ops[op_id] = Operation(kind, amount, balance, datetime.fromisoformat(timestamp))
+        shifts = db.execute("SELECT after_id, stop_id, delta FROM balance_shifts").fetchall()
+        if shifts:
+            keys = np.fromiter(ops, dtype=np.int64, count=len(ops))
+            moved = np.zeros(len(keys) + 1, dtype=np.int64)
+            for after_id, stop_id, delta in shifts:
+                moved[np.searchsorted(keys, after_id, side="right")] += delta
+                moved[np.searchsorted(keys, stop_id)] -= delta
+            for op, delta in zip(ops.values(), np.cumsum(moved[:-1]).tolist()):
+                op.balance += delta
+        lo, hi = min(ops), max(ops)
+        for op_id, name, item_type, price, count in db.execute(
+                "SELECT op_id, name, item_type, price, count FROM operation_items WHERE op_id BETWEEN ? AND ?", (lo, hi)):
+            if op_id in ops:
+                ops[op_id].items.append(Item(name, item_type, price, count))
+        return [ops[row[0]] for row in rows]
+
+    def save(self, state):
+        db = self.connect()
+        with db:
+            db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [
+                ("balance", str(state["balance"])),
+                ("item_list", json.dumps([item.to_dict() for item in state["item_list"]]))])
+            db.executemany("INSERT OR IGNORE INTO item_types VALUES (?)", [(t,) for t in state["item_types"]])
+            db.executemany("INSERT INTO items VALUES (?, ?, ?) ON CONFLICT(name) DO UPDATE SET item_type=excluded.item_type, price=excluded.price",
+                           [(i.name, i.item_type, i.price) for i in state["items"]])
+
+    def record_operation(self, op, balance):
+        self.record_operations([op], balance)
+
+    def record_operations(self, ops, balance):
+        db = self.connect()
+        with db:
+            first = insert_operations(db, ops)
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('balance', ?)", (str(balance),))
+        self.ids.extend(range(first, first + len(ops)))
+
+    def rewrite(self, state):
+        db = self.connect()
+        with db:
+            db.execute("DELETE FROM operation_items")
+            db.execute("DELETE FROM operations")
+            db.execute("DELETE FROM balance_shifts")
+            first = insert_operations(db, state["history"])
+        self.ids = array("q", range(first, first + len(state["history"])))
+        self.save(state)
+
+    def record_edit(self, index, op, stop, delta, state):
+        n = len(state["history"])
+        op_id = self.ids[index - n]
+        db = self.connect()
+        with db:
+            # The stored balance is what the shifts covering this row do not already add.
+            covered = db.execute("SELECT COALESCE(SUM(delta), 0) FROM balance_shifts WHERE after_id < ? AND ? < stop_id",
+                                 (op_id, op_id)).fetchone()[0]
+            db.execute("UPDATE operations SET kind = ?, amount = ?, balance = ?, timestamp = ? WHERE id = ?",
+                       (op.kind, op.amount, op.balance - covered, op.timestamp.isoformat(), op_id))
+            db.execute("DELETE FROM operation_items WHERE op_id = ?", (op_id,))
+            db.executemany("INSERT INTO operation_items VALUES (?, ?, ?, ?, ?)",
+                           [(op_id, i.name, i.item_type, i.price, i.count) for i in op.items])
+            self.shift_balances(db, op_id, stop - n, delta, state["balance"])
+
+    def record_delete(self, index, stop, delta, state):
+        n = len(state["history"])
+        op_id = self.ids[index - n - 1]
+        del self.ids[index - n - 1]
+        db = self.connect()
+        with db:
+            db.execute("DELETE FROM operation_items WHERE op_id = ?", (op_id,))
+            db.execute("DELETE FROM operations WHERE id = ?", (op_id,))
+            self.shift_balances(db, op_id, stop - n, delta, state["balance"])
+
+    def shift_balances(self, db, after_id, stop, delta, balance):
+        # Rows after `after_id` up to the "Set balance" at position `stop` (from the end)
+        # move by delta; without one, the shift runs to the last row and the balance.
+        # Either way it is one recorded shift, applied to the rows as they load.
+        if delta and stop < 0:
+            stop_id = self.ids[stop]
+            db.execute("UPDATE operations SET amount = amount - ? WHERE id = ?", (delta, stop_id))
+        else:
+            stop_id = self.ids[-1] + 1 if self.ids else after_id
+        if delta and stop_id > after_id + 1:
+            db.execute("INSERT INTO balance_shifts VALUES (?, ?, ?)", (after_id, stop_id, delta))
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('balance', ?)", (str(balance),))
+
+    def record_item(self, item):
+        with self.connect() as db:
+            db.execute("INSERT INTO items VALUES (?, ?, ?) ON CONFLICT(name) DO UPDATE SET item_type=excluded.item_type, price=excluded.price",
+                       (item.name, item.item_type, item.price))
+
+    def record_type(self, item_type):
+        with self.connect() as db:
+            db.execute("INSERT OR IGNORE INTO item_types VALUES (?)", (item_type,))
+
+    def detach(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def close(self, state):
+        self.save(state)
+        self.detach()
+
+
+def insert_operations(db, ops):
+    # Ids are assigned up front so operations and their items go in as two executemany calls.
+    # They also start past every recorded shift, so no shift reaches a new row.
+    next_id = max((db.execute("SELECT MAX(id) FROM operations").fetchone()[0] or 0) + 1,
+                  db.execute("SELECT MAX(stop_id) FROM balance_shifts").fetchone()[0] or 0)
+    rows = []
+    items = []
+    for op_id, op in enumerate(ops, next_id):
+        rows.append((op_id, op.kind, op.amount, op.balance, op.timestamp.isoformat()))
+        items.extend((op_id, i.name, i.item_type, i.price, i.count) for i in op.items)
+    db.executemany("INSERT INTO operations (id, kind, amount, balance, timestamp) VALUES (?, ?, ?, ?, ?)", rows)
+    db.executemany("INSERT INTO operation_items VALUES (?, ?, ?, ?, ?)", items)
+    return next_id
+
+
+def migrate_json_to_sqlite(json_path=DATA_FILE, db=DB_FILE):
+    store = SqliteStore()
+    if isinstance(db, str):
+        store.db_path = db
+    else:
+        store.db = db
+    state = JsonStore(json_path).load()
+    if state is None:
+        return 0
+    db = store.connect()
+    with db:
+        insert_operations(db, state["history"])
+    store.save(state)
+    return len(state["history"])
+
+
+# Binary ledger: a fixed header, the catalog and basket as compact JSON, a string table
+# (u64 offsets + UTF-8 blob) and then fixed-width operation and item rows, little-endian.
+BIN_MAGIC = b"FCB1"
+BIN_HEADER = struct.Struct("<4sIQQQQQQQQq")
+BIN_OP = np.dtype([("kind", "<u4"), ("items", "<u4"), ("amount", "<i8"), ("balance", "<i8"),
+                   ("time", "<i8"), ("first_item", "<u8")])
+BIN_ITEM = np.dtype([("name", "<u4"), ("item_type", "<u4"), ("price", "<i8"), ("count", "<i4")])
+
+
+class BinaryLedger:
+    # Read-only view of a binary ledger through mmap: opening only parses the header, rows
+    # and strings are decoded when they are accessed.
+    def __init__(self, path=BIN_FILE):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, op_count, item_count, string_count, meta_offset, meta_length,
+         strings_offset, ops_offset, items_offset, self.balance) = BIN_HEADER.unpack_from(self.map)
+        if magic != BIN_MAGIC or version != 1:
+            raise ValueError(f"{path} is not a FinTrack binary ledger")
+        self.meta_range = (meta_offset, meta_offset + meta_length)
+        self.string_offsets = np.frombuffer(self.map, dtype="<u8", count=string_count + 1, offset=strings_offset)
+        self.strings = [None] * string_count
+        self.ops = np.frombuffer(self.map, dtype=BIN_OP, count=op_count, offset=ops_offset)
+        self.items = np.frombuffer(self.map, dtype=BIN_ITEM, count=item_count, offset=items_offset)
+
+    def __len__(self):
+        return len(self.ops)
+
+    def string(self, sid):
+        value = self.strings[sid]
+        if value is None:
+            a, b = int(self.string_offsets[sid]), int(self.string_offsets[sid + 1])
+            value = self.strings[sid] = sys.intern(self.map[a:b].decode("utf-8"))
+        return value
+
+    def meta(self):
+        return json.loads(self.map[self.meta_range[0]:self.meta_range[1]])
+
+    def __getitem__(self, index):
+        row = self.ops[index]
+        first = int(row["first_item"])
+        op = Operation.__new__(Operation)
+        op.kind = self.string(int(row["kind"]))
+        op.amount = int(row["amount"])
+        op.balance = int(row["balance"])
+        op.time = int(row["time"])
+        op.items = [Item(self.string(int(i["name"])), self.string(int(i["item_type"])), int(i["price"]), int(i["count"]))
+                    for i in self.items[first:first + int(row["items"])]]
+        return op
+
+    def to_log(self, start=0, stop=None):
+        # Copies rows start:stop straight into an OperationLog, chunk by chunk, without
+        # building Operation objects. String ids stay those of the file.
+        stop = len(self.ops) if stop is None else stop
+        log = OperationLog()
+        log.strings = [self.string(sid) for sid in range(len(self.strings))]
+        log.string_ids = {value: sid for sid, value in enumerate(log.strings)}
+        for a in range(start, stop, OPERATION_CHUNK):
+            rows = self.ops[a:min(a + OPERATION_CHUNK, stop)]
+            base = int(rows["first_item"][0])
+            end = int(rows["first_item"][-1]) + int(rows["items"][-1])
+            items = self.items[base:end]
+            chunk = OperationChunk()
+            chunk.kind = array("I", rows["kind"].tobytes())
+            chunk.amount = array("q", rows["amount"].tobytes())
+            chunk.balance = array("q", rows["balance"].tobytes())
+            chunk.time = array("q", rows["time"].tobytes())
+            chunk.first_item = array("I", np.append(rows["first_item"] - base, end - base).astype(np.uint32).tobytes())
+            chunk.name = array("I", items["name"].tobytes())
+            chunk.item_type = array("I", items["item_type"].tobytes())
+            chunk.price = array("q", items["price"].tobytes())
+            chunk.count = array("i", items["count"].tobytes())
+            log.chunks.append(chunk)
+            log.offsets.append(0)
+        log.reindex()
+        return log
+
+    def close(self):
+        # NumPy views hold the map open until they are dropped.
+        self.string_offsets = self.ops = self.items = None
+        self.map.close()
+        self.file.close()
+
+
+def write_binary(path, state):
+    history = state["history"]
+    log = history if isinstance(history, OperationLog) else OperationLog(history)
+    meta = compact_json({
+        "item_list": [item.to_dict() for item in state["item_list"]],
+        "item_types": [item for item in state["item_types"]],
+        "items": [item.to_dict() for item in state["items"]]
+    }).encode("utf-8")
+    blobs = [value.encode("utf-8") for value in log.strings]
+    string_offsets = np.zeros(len(blobs) + 1, dtype="<u8")
+    ops = np.zeros(len(log), dtype=BIN_OP)
+    items = np.zeros(sum(len(chunk.name) for chunk in log.chunks), dtype=BIN_ITEM)
+    done = 0
+    for c, (start, chunk) in enumerate(zip(log.starts, log.chunks)):
+        rows = ops[start:start + len(chunk)]
+        first = np.frombuffer(chunk.first_item, dtype=np.uint32)
+        rows["kind"] = np.frombuffer(chunk.kind, dtype=np.uint32)
+        rows["items"] = np.diff(first)
+        rows["amount"] = np.frombuffer(chunk.amount, dtype=np.int64)
+        rows["balance"] = np.frombuffer(chunk.balance, dtype=np.int64) + log.offset(c)
+        rows["time"] = np.frombuffer(chunk.time, dtype=np.int64)
+        rows["first_item"] = first[:-1].astype(np.uint64) + done
+        part = items[done:done + len(chunk.name)]
+        part["name"] = np.frombuffer(chunk.name, dtype=np.uint32)
+        part["item_type"] = np.frombuffer(chunk.item_type, dtype=np.uint32)
+        part["price"] = np.frombuffer(chunk.price, dtype=np.int64)
+        part["count"] = np.frombuffer(chunk.count, dtype=np.int32)
+        done += len(chunk.name)
+    meta_offset = BIN_HEADER.size
+    strings_offset = -(-(meta_offset + len(meta)) // 8) * 8
+    blob_offset = strings_offset + string_offsets.nbytes
+    string_offsets[1:] = np.cumsum([len(blob) for blob in blobs], dtype=np.uint64)
+    string_offsets += blob_offset
+    ops_offset = -(-int(string_offsets[-1]) // 8) * 8
+    items_offset = ops_offset + ops.nbytes
+    header = BIN_HEADER.pack(BIN_MAGIC, 1, len(ops), len(items), len(blobs), meta_offset, len(meta),
+                             strings_offset, ops_offset, items_offset, state["balance"])
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(meta)
+        f.write(b"\0" * (strings_offset - f.tell()))
+        f.write(string_offsets.tobytes())
+        f.write(b"".join(blobs))
+        f.write(b"\0" * (ops_offset - f.tell()))
+        f.write(ops.tobytes())
+        f.write(items.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class BinaryStore(JsonStore):
+    # Whole-ledger store like JsonStore, but the history loads by copying mmap'd columns.
+    # Only the most recent rows are copied up front; the file stays mapped until
+    # iter_older has copied the rest.
+    def __init__(self, path=BIN_FILE, legacy_path=DATA_FILE):
+        super().__init__(path)
+        self.legacy_path = legacy_path
+        self.reader = None
+        self.older_end = 0
+
+    def load_head(self, recent):
+        if not os.path.exists(self.path):
+            if not os.path.exists(self.legacy_path):
+                return None
+            write_binary(self.path, JsonStore(self.legacy_path).load())
+        self.detach()
+        reader = BinaryLedger(self.path)
+        meta = reader.meta()
+        split = 0 if recent is None else max(0, len(reader) - recent)
+        state = {
+            "balance": reader.balance,
+            "item_list": [Item(**item) for item in meta["item_list"]],
+            "item_types": meta["item_types"],
+            "items": [Item(**item) for item in meta["items"]],
+            "history": reader.to_log(split)
+        }
+        self.complete = not split
+        if split:
+            self.reader, self.older_end = reader, split
+        else:
+            reader.close()
+        return state
+
+    def iter_older(self, batch=LOAD_BATCH):
+        # Batches are OperationLogs in the file's string ids, so they splice in without
+        # being turned into Operation objects.
+        reader, self.reader = self.reader, None
+        if reader is None:
+            return
+        try:
+            for end in range(self.older_end, 0, -batch):
+                yield reader.to_log(max(0, end - batch), end)
+        finally:
+            reader.close()
+
+    def detach(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+    def save(self, state):
+        write_binary(self.path, state)
+
+
+def convert_ledger(target, json_path=DATA_FILE, bin_path=BIN_FILE):
+    # Lossless both ways for everything Operation.to_dict writes.
+    if target == "binary":
+        state = JsonStore(json_path).load()
+        if state is not None:
+            write_binary(bin_path, state)
+    else:
+        state = BinaryStore(bin_path, legacy_path="").load()
+        if state is not None:
+            JsonStore(json_path).save(state)
+    return len(state["history"]) if state is not None else 0
+
+
+def make_store(mode=STORAGE_MODE, directory="."):
+    path = lambda name: os.path.join(directory, name)
+    if mode == "journal":
+        return JournalStore(path(SNAPSHOT_FILE), path(JOURNAL_FILE), path(DATA_FILE))
+    if mode == "sqlite":
+        return SqliteStore(path(DB_FILE), path(DATA_FILE))
+    if mode == "binary":
+        return BinaryStore(path(BIN_FILE), path(DATA_FILE))
+    return JsonStore(path(DATA_FILE))
+
+
+class AccountSummary:
+    # What consolidated figures need from an account that is not open: balance, catalog,
+    # spend per type and day, and the flow column. Built in a worker process from the
+    # stored state and cheap to send back, unlike a whole Ledger.
+    def __init__(self, state=None):
+        self.balance = 0
+        self.items = []
+        self.item_types = []
+        self.type_spend = TypeSpend()
+        self.times = np.zeros(0, dtype=np.int64)
+        self.flows = np.zeros(1, dtype=np.int64)  # flows[i]: net flow of the first i operations
+        if state is None:
+            return
+        history = state["history"]
+        log = history if isinstance(history, OperationLog) else OperationLog(history)
+        self.balance = state["balance"]
+        self.items = list(state["items"])
+        self.item_types = list(state["item_types"])
+        self.type_spend.rebuild(log)
+        self.times = log.column("time", 0, len(log))
+        kinds = log.kind_ids()
+        self.flows = np.concatenate([np.zeros(1, dtype=np.int64)] + [chunk.flows(*kinds) for chunk in log.chunks]).cumsum()
+
+    def net_flow(self, start=None, end=None):
+        a = int(np.searchsorted(self.times, to_micros(start))) if start else 0
+        b = int(np.searchsorted(self.times, to_micros(end))) if end else len(self.times)
+        return int(self.flows[b] - self.flows[a]) if b > a else 0
+
+
+def summarize_account(directory, mode):
+    # Runs in a worker process.
+    store = make_store(mode, directory)
+    state = store.load()
+    store.detach()
+    return AccountSummary(state)
+
+
+class Accounts:
+    # Accounts by name, sharing one item catalog. Open accounts have a Ledger; the others
+    # are summarized in worker processes and only opened when needed. Consolidated
+    # figures are summed from each account's own aggregates.
+    def __init__(self, mode=STORAGE_MODE, root=ACCOUNTS_DIR):
+        self.mode = mode
+        self.root = root
+        self.catalog = Catalog()
+        self.ledgers = {}
+        self.summaries = {}
+        self.pending = {}
+        self.pool = None
+
+    def names(self):
+        names = [MAIN_ACCOUNT]
+        if os.path.isdir(self.root):
+            names += sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+        return names
+
+    def directory(self, name):
+        return "." if name == MAIN_ACCOUNT else os.path.join(self.root, name)
+
+    def merge_catalog(self, item_types, items):
+        for item_type in item_types:
+            self.catalog.add_type(item_type)
+        for item in items:
+            self.catalog.add(item)
+
+    def adopt(self, name, ledger):
+        clean = not ledger.dirty
+        self.merge_catalog(ledger.catalog.types, ledger.catalog.items.values())
+        # The merge leaves this ledger's own entries as they were, so its files are only
+        # behind when other accounts brought in something new.
+        behind = len(self.catalog.items) > len(ledger.catalog.items) or len(self.catalog.types) > len(ledger.catalog.types)
+        ledger.catalog = self.catalog
+        if clean and not behind:
+            ledger.saved = ledger.mark()
+        ledger.store.state = ledger.get_state()
+        self.ledgers[name] = ledger
+        self.summaries.pop(name, None)
+        return ledger
+
+    def open(self, name, recent=None):
+        ledger = Ledger(make_store(self.mode, self.directory(name)))
+        ledger.load(recent)
+        return self.adopt(name, ledger)
+
+    def load(self, names=None, workers=None):
+        # Summaries of the given accounts, waited for; the CLI totals use this.
+        names = names or self.names()
+        workers = workers or min(len(names), os.cpu_count() or 1)
+        if workers == 1:
+            for name in names:
+                self.add_summary(name, summarize_account(self.directory(name), self.mode))
+        else:
+            self.start_summaries(names, workers)
+            self.collect(wait=True)
+        return self.summaries
+
+    def start_summaries(self, names, workers=None):
+        # Returns at once; collect() takes the summaries in as they finish.
+        workers = workers or min(len(names), os.cpu_count() or 1)
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        for name in names:
+            self.pending[name] = self.pool.submit(summarize_account, self.directory(name), self.mode)
+
+    def collect(self, wait=False):
+        done = [name for name, future in self.pending.items() if wait or future.done()]
+        for name in done:
+            self.add_summary(name, self.pending.pop(name).result())
+        if not self.pending and self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+        return bool(done)
+
+    def add_summary(self, name, summary):
+        # An account opened in the meantime already has its figures.
+        if name not in self.ledgers:
+            self.merge_catalog(summary.item_types, summary.items)
+            self.summaries[name] = summary
+
+    def members(self):
+        # Open ledgers and summaries alike have balance, type_spend and net_flow().
+        members = {}
+        for name in self.names():
+            if name in self.ledgers:
+                members[name] = self.ledgers[name]
+            elif name in self.summaries:
+                members[name] = self.summaries[name]
+        return members
+
+    def create(self, name):
+        name = name.strip()
+        if not name or name in self.names() or os.sep in name or (os.altsep and os.altsep in name) or name.startswith("."):
+            raise ValueError(f"Invalid or existing account name: {name!r}")
+        os.makedirs(self.directory(name))
+        return self.open(name)
+
+    def totals(self, start=None):
+        # One row per account and a total row: balance, purchase spend and net flow since start.
+        rows = []
+        for name, member in self.members().items():
+            rows.append({"account": name, "balance": member.balance,
+                         "spent": sum(member.type_spend.spend_since(start.date() if start else None).values()),
+                         "net": member.net_flow(start)})
+        rows.append({"account": "Total", **{key: sum(row[key] for row in rows) for key in ("balance", "spent", "net")}})
+        return rows
+
+    def spend_by_type(self, start=None):
+        result = {}
+        for member in self.members().values():
+            for item_type, spend in member.type_spend.spend_since(start).items():
+                result[item_type] = result.get(item_type, 0) + spend
+        return result
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+        for ledger in self.ledgers.values():
+            ledger.close()
+
+
+class Ledger:
+    # Everything FinTrack knows about an account, without any UI: balance, history,
+    # catalog, basket, the derived aggregates and persistence. Views subscribe to
+    # ("insert" | "update" | "remove", index, count) change events.
+    def __init__(self, store=None):
+        self.store = store or make_store()
+        self.balance = 0
+        self.operations = OperationLog()
+        self.catalog = Catalog()
+        self.item_list = []
+        self.basket_total = 0
+        self.listeners = []
+        self.rollup = ItemRollup()
+        self.type_spend = TypeSpend()
+        self.balance_series = BalanceSeries(self.operations)
+        self.balance_index = BalanceIndex(self.operations)
+        self.search_index = HistoryIndex(self.operations)
+        self.revision = 0
+        self.saved = self.mark()
+        self.changed_at = time.monotonic()
+
+    def load(self, recent=None):
+        state = self.store.load_head(recent)
+        if state is not None:
+            self.balance = state["balance"]
+            self.item_list = state["item_list"]
+            self.basket_total = sum(item.price * item.count for item in self.item_list)
+            self.catalog = Catalog(state["items"], state["item_types"])
+            history = state["history"]
+            self.operations = history if isinstance(history, OperationLog) else OperationLog(history)
+        self.store.state = self.get_state()
+        self.update_aggregates()
+        # A file in an older layout counts as unsaved, so the autosave rewrites it.
+        self.saved = None if self.store.outdated else self.mark()
+
+    def insert_older(self, batch):
+        self.operations.prepend(batch)
+        self.update_aggregates(0, batch)
+        self.notify("insert", 0, len(batch))
+
+    def get_state(self):
+        return {
+            "balance": self.balance,
+            "item_list": self.item_list,
+            "item_types": self.catalog.types,
+            "items": self.catalog.items.values(),
+            "history": self.operations
+        }
+
+    def mark(self):
+        # Identifies the ledger and catalog contents; anything after `saved` is unsaved.
+        return self.revision, self.catalog.version
+
+    @property
+    def dirty(self):
+        return self.mark() != self.saved
+
+    def touch(self):
+        self.revision += 1
+        self.changed_at = time.monotonic()
+
+    def save(self):
+        mark = self.mark()
+        self.store.save(self.get_state())
+        self.saved = mark
+
+    def checkpoint(self):
+        mark = self.mark()
+        self.store.checkpoint(self.get_state())
+        self.saved = mark
+
+    def snapshot(self):
+        # The state as of now for a save on another thread: basket and catalog are copied,
+        # history shares its chunks until saved_snapshot() releases them.
+        copy = lambda items: [Item(item.name, item.item_type, item.price, item.count) for item in items]
+        state = {
+            "balance": self.balance,
+            "item_list": copy(self.item_list),
+            "item_types": list(self.catalog.types),
+            "items": copy(self.catalog.items.values()),
+            "history": self.operations.snapshot()
+        }
+        self.store.begin_snapshot(state)
+        return self.mark(), state
+
+    def saved_snapshot(self, mark):
+        self.operations.release()
+        self.saved = mark
+
+    def close(self):
+        # Whole-file stores have nothing to write when the last save is current.
+        if self.store.incremental or self.dirty:
+            self.store.close(self.get_state())
+        self.saved = self.mark()
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def notify(self, action, index, count=1):
+        for listener in self.listeners:
+            listener(action, index, count)
+
+    def update_aggregates(self, index=None, ops=None):
+        # Inserted operations are folded in directly; anything else rebuilds from history.
+        if ops is None:
+            self.rollup.rebuild(self.operations)
+            self.type_spend.rebuild(self.operations)
+            self.balance_series.rebuild(self.operations)
+            self.balance_index.rebuild(self.operations)
+            self.search_index = HistoryIndex(self.operations)
+            return
+        if len(ops) == 1:
+            self.rollup.add_operation(ops[0])
+            self.type_spend.add_operation(ops[0])
+            self.balance_series.insert(index, ops)
+        else:
+            self.rollup.add_log(self.operations, index, index + len(ops))
+            self.type_spend.add_log(self.operations, index, index + len(ops))
+            self.balance_series.insert_log(self.operations, index, index + len(ops))
+        self.balance_index.insert(index, ops)
+        self.search_index.insert(index, ops)
+
+    def add_operation(self, op):
+        self.operations.append(op)
+        self.store.record_operation(op, self.balance)
+        self.touch()
+        self.update_aggregates(len(self.operations) - 1, [op])
+        self.notify("insert", len(self.operations) - 1)
+        return op
+
+    def add_income(self, amount, income_type):
+        if income_type == "Set":
+            b1 = self.balance
+            self.balance = amount
+            return self.add_operation(Operation("Set balance", self.balance - b1, self.balance))
+        self.balance += amount
+        if amount > 0:
+            return self.add_operation(Operation("Income (" + income_type + ")", amount, self.balance))
+        return self.add_operation(Operation("Expense (" + income_type + ")", amount, self.balance))
+
+    def add_to_basket(self, item):
+        self.item_list.append(item)
+        self.basket_total += item.price * item.count
+        self.touch()
+        new_type, new_name, changed = self.catalog.add(item)
+        if new_type:
+            self.store.record_type(item.item_type)
+        if changed:
+            self.store.record_item(item)
+        return new_type, new_name, changed
+
+    def change_basket_item(self, item, price=None, count=None):
+        # The basket total moves by the edited row's delta instead of being re-summed.
+        old = item.price * item.count
+        if price is not None:
+            item.price = price
+        if count is not None:
+            item.count = count
+        self.basket_total += item.price * max(item.count, 0) - old
+        self.touch()
+
+    def remove_from_basket(self, item):
+        self.item_list.remove(item)
+        self.basket_total -= item.price * max(item.count, 0)
+        self.touch()
+
+    def clear_basket(self):
+        self.item_list.clear()
+        self.basket_total = 0
+        self.touch()
+
+    def pending(self):
+        return self.basket_total
+
+    def check_out(self):
+        pending = self.pending()
+        self.balance -= pending
+        op = self.add_operation(Operation("Purchase", pending, self.balance, None, self.item_list.copy()))
+        self.clear_basket()
+        return op
+
+    def import_operations(self, ops):
+        # Appends already-built operations in one batch: one store write, one event.
+        ops.sort(key=lambda op: op.time)
+        if ops and len(self.operations) and ops[0].time < self.operations[-1].time:
+            return self.merge_operations(ops)
+        for op in ops:
+            self.balance += -op.amount if op.kind == "Purchase" else op.amount
+            op.balance = self.balance
+        start = len(self.operations)
+        self.operations.extend(ops)
+        self.store.record_operations(ops, self.balance)
+        if ops:
+            self.touch()
+            self.update_aggregates(start, ops)
+            self.notify("insert", start, len(ops))
+        return len(ops)
+
+    def merge_operations(self, ops):
+        # A batch reaching back before the last operation goes into time order (after
+        # existing operations at the same instant). Balances from the first merged row on
+        # are re-derived, a later "Set balance" absorbing the difference as on edits.
+        if not self.store.complete:
+            raise ValueError("older history is still loading")
+        log = self.operations
+        start = log.bisect_time(ops[0].time)
+        before = log.balance(start - 1) if start else 0
+        log.extend(list(heapq.merge(log.truncate(start), ops, key=lambda op: op.time)))
+        self.balance, _ = log.recompute_balances(before, start)
+        self.store.rewrite(self.get_state())
+        self.touch()
+        self.update_aggregates()
+        self.notify("insert", start, len(ops))
+        return len(ops)
+
+    def import_csv(self, path, date_column="date", amount_column="amount", category_column="category",
+                   date_format=None, delimiter=",", decimal_comma=False):
+        ops = []
+        kinds = {}
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.reader(f, delimiter=delimiter)
+            header = next(reader)
+            date_at = header.index(date_column)
+            amount_at = header.index(amount_column)
+            category_at = header.index(category_column) if category_column in header else None
+            for row in reader:
+                if not row:
+                    continue
+                raw = row[amount_at].replace(" ", "").replace("\xa0", "")
+                if decimal_comma:
+                    raw = raw.replace(".", "").replace(",", ".")
+                amount = to_cents(float(raw))
+                date = row[date_at].strip()
+                timestamp = datetime.strptime(date, date_format) if date_format else datetime.fromisoformat(date)
+                category = row[category_at].strip() if category_at is not None else ""
+                key = (category, amount > 0)
+                kind = kinds.get(key)
+                if kind is None:
+                    kind = kinds[key] = ("Income (" if amount > 0 else "Expense (") + (category or "Other") + ")"
+                ops.append(Operation(kind, amount, 0, timestamp))
+        return self.import_operations(ops)
+
+    def recompute_balances(self):
+        self.balance, changed = self.operations.recompute_balances()
+        if changed:
+            self.store.rewrite(self.get_state())
+            self.touch()
+            self.update_aggregates()
+            self.notify("update", 0, len(self.operations))
+        return changed
+
+    def verify_balances(self):
+        return self.operations.verify_balances()
+
+    def balance_at(self, when):
+        # Balance right after the last operation at or before `when`.
+        i = self.operations.bisect_time(to_micros(when))
+        return self.operations.balance(i - 1) if i else 0
+
+    def net_flow(self, start=None, end=None):
+        return self.balance_index.net_flow(start, end)
+
+    def search(self, text=None, kind=None, min_amount=None, max_amount=None, start=None, end=None):
+        # Chronological positions of matching operations. Dates bound a position range by
+        # bisection, item text goes through the inverted index, and kind and amount
+        # (compared by magnitude, in cents) are vectorized masks over that range only.
+        log = self.operations
+        a = log.bisect_time(to_micros(start), right=False) if start else 0
+        b = log.bisect_time(to_micros(end), right=False) if end else len(log)
+        if b <= a:
+            return np.zeros(0, dtype=np.int64)
+        mask = np.ones(b - a, dtype=bool)
+        if text:
+            hits = self.search_index.lookup(text)
+            hits = hits[(hits >= a) & (hits < b)]
+            found = np.zeros(b - a, dtype=bool)
+            found[hits - a] = True
+            mask &= found
+        if kind:
+            ids = [sid for sid, value in enumerate(log.strings) if value.startswith(kind)]
+            mask &= np.isin(log.column("kind", a, b), ids)
+        if min_amount is not None or max_amount is not None:
+            amounts = np.abs(log.column("amount", a, b))
+            if min_amount is not None:
+                mask &= amounts >= min_amount
+            if max_amount is not None:
+                mask &= amounts <= max_amount
+        return np.flatnonzero(mask) + a
+
+    def edit_operation(self, index, op):
+        # Replaces a past operation in place. Later balances move by the change up to the
+        # next "Set balance", whose correction amount absorbs it.
+        log = self.operations
+        old = log[index]
+        before = log.balance(index - 1) if index else 0
+        if op.kind == "Set balance":
+            op.amount = op.balance - before
+        else:
+            op.balance = before + op_flow(op)
+        log.replace(index, op)
+        self.rollup.add_operation(old, -1)
+        self.rollup.add_operation(op)
+        self.type_spend.add_operation(old, -1)
+        self.type_spend.add_operation(op)
+        self.balance_series.replace(index, op)
+        self.search_index.invalidate()
+        self.balance_index.update(index, op_flow(op) - op_flow(old), (op.kind == "Set balance") - (old.kind == "Set balance"))
+        stop = self.shift_balances(index + 1, op.balance - old.balance)
+        self.store.record_edit(index, op, stop, op.balance - old.balance, self.get_state())
+        self.touch()
+        self.notify("update", index, stop - index)
+        return op
+
+    def delete_operation(self, index):
+        log = self.operations
+        old = log[index]
+        before = log.balance(index - 1) if index else 0
+        c = bisect_right(log.starts, index) - 1
+        chunks = len(log.chunks)
+        log.delete(index)
+        if len(log.chunks) == chunks:
+            self.balance_index.add(c, -op_flow(old), -(old.kind == "Set balance"))
+        else:
+            self.balance_index.rebuild(log)
+        self.rollup.add_operation(old, -1)
+        self.type_spend.add_operation(old, -1)
+        self.balance_series.remove(index)
+        self.search_index.invalidate()
+        stop = self.shift_balances(index, before - old.balance)
+        self.store.record_delete(index, stop, before - old.balance, self.get_state())
+        self.touch()
+        self.notify("remove", index)
+        return old
+
+    def shift_balances(self, start, delta):
+        # O(log n) plus two chunks: the next "Set balance" comes from the balance index,
+        # and the log moves whole chunks of balances through its offset tree.
+        log = self.operations
+        stop = self.balance_index.next_reset(start - 1)
+        log.shift_balances(start, stop, delta)
+        self.balance_series.refresh()
+        if stop < len(log):
+            log.adjust_amount(stop, -delta)
+        else:
+            self.balance += delta
+        return stop
+
+    def report(self, start=None, end=None, period="month"):
+        start = to_micros(start) if start else None
+        end = to_micros(end) if end else None
+        rows = {}
+        for kind, amount, balance, time in self.operations.rows():
+            if (start is not None and time < start) or (end is not None and time >= end):
+                continue
+            timestamp = EPOCH + timedelta(microseconds=time)
+            if period == "day":
+                key = timestamp.strftime("%Y-%m-%d")
+            elif period == "week":
+                key = "%04d-W%02d" % timestamp.isocalendar()[:2]
+            elif period == "year":
+                key = f"{timestamp.year:04d}"
+            else:
+                key = f"{timestamp.year:04d}-{timestamp.month:02d}"
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = {"period": key, "income": 0, "expense": 0, "purchases": 0, "operations": 0}
+            row["operations"] += 1
+            if kind == "Purchase":
+                row["purchases"] += amount
+            elif kind.startswith("Income"):
+                row["income"] += amount
+            elif kind.startswith("Expense"):
+                row["expense"] -= amount
+            row["balance"] = balance
+        report = []
+        for key in sorted(rows):
+            row = rows[key]
+            row["net"] = row["income"] - row["expense"] - row["purchases"]
+            report.append({k: from_cents(v) if k not in ("period", "operations") else v for k, v in row.items()})
+        return report
+
+
+class HistoryRow:
+    def __init__(self, view):
+        self.view = view
+        self.index = None
+        self.expanded = False
+        self.frame = tk.Frame(view.canvas, bg="#3a3a3a")
+        bar = tk.Frame(self.frame, bg="#3a3a3a")
+        bar.pack(fill="x")
+        self.label = tk.Label(bar, fg="white", bg="#3a3a3a")
+        self.label.pack(side="left", pady=4)
+        self.button = tk.Button(bar, text="Expand", command=self.toggle, fg="white", bg="#323232")
+        self.details = tk.Label(self.frame, font=("Arial", 10), justify="left", anchor="nw", fg="white", bg="#444")
+
+    def show(self, index, op, y, height):
+        expanded = index in self.view.expanded
+        if index != self.index or expanded != self.expanded:
+            self.index = index
+            self.expanded = expanded
+            self.label.configure(text=f"[{op.timestamp.strftime('%Y-%m-%d %H:%M')}] {op.kind}: {from_cents(op.amount):.2f} ₽   Balance: {from_cents(op.balance):.2f} ₽")
+            if op.items:
+                self.button.configure(text="Collapse" if expanded else "Expand")
+                self.button.pack(side="right")
+            else:
+                self.button.pack_forget()
+            if expanded:
+                # Item details are only built for rows that are both expanded and on screen.
+                self.details.configure(text="\n".join(f"  - {i.name} ({i.count}) ({from_cents(i.price * i.count):.2f})" for i in op.items))
+                self.details.pack(fill="x")
+            else:
+                self.details.pack_forget()
+        self.frame.place(x=10, y=y + 3, height=height - 6, relwidth=1, width=-20)
+
+    def hide(self):
+        self.index = None
+        self.frame.place_forget()
+
+    def toggle(self):
+        self.view.toggle(self.index)
+
+
+class HistoryView:
+    # Only the rows inside the viewport exist as widgets; they are recycled while scrolling.
+    # Rows are keyed by their position in the chronological operations list.
+    def __init__(self, parent, get_operations):
+        self.get_operations = get_operations
+        self.canvas = tk.Canvas(parent, bg="#323232", highlightthickness=0)
+        self.scrollbar = tk.Scrollbar(parent, orient="vertical", command=self.on_scroll)
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+        self.top = 0
+        self.rows = []
+        self.expanded = {}
+        self.canvas.bind("<Configure>", lambda e: self.render())
+        self.canvas.bind_all("<MouseWheel>", lambda e: self.scroll(int(-1 * (e.delta / 120)) * HISTORY_ROW_HEIGHT))
+
+    def total_height(self):
+        return len(self.get_operations()) * HISTORY_ROW_HEIGHT + sum(self.expanded.values())
+
+    def row_y(self, pos):
+        count = len(self.get_operations())
+        return pos * HISTORY_ROW_HEIGHT + sum(extra for index, extra in self.expanded.items() if count - 1 - index < pos)
+
+    def locate(self, top):
+        # Returns the display position of the row under pixel `top` and that row's y.
+        count = len(self.get_operations())
+        extra = 0
+        for index in sorted(self.expanded, reverse=True):
+            pos = count - 1 - index
+            y = pos * HISTORY_ROW_HEIGHT + extra
+            if top < y:
+                break
+            if top < y + HISTORY_ROW_HEIGHT + self.expanded[index]:
+                return pos, y
+            extra += self.expanded[index]
+        pos = max(0, (top - extra) // HISTORY_ROW_HEIGHT)
+        return pos, pos * HISTORY_ROW_HEIGHT + extra
+
+    def render(self):
+        ops = self.get_operations()
+        view_height = self.canvas.winfo_height()
+        total = self.total_height()
+        self.top = max(0, min(self.top, total - view_height))
+        pos, y = self.locate(self.top)
+        used = 0
+        while pos < len(ops) and y < self.top + view_height:
+            index = len(ops) - 1 - pos
+            height = HISTORY_ROW_HEIGHT + self.expanded.get(index, 0)
+            if used == len(self.rows):
+                self.rows.append(HistoryRow(self))
+            self.rows[used].show(index, ops[index], y - self.top, height)
+            used += 1
+            pos += 1
+            y += height
+        for row in self.rows[used:]:
+            row.hide()
+        if total > 0:
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + view_height) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def on_scroll(self, action, amount, unit=None):
+        if action == "moveto":
+            self.top = int(float(amount) * self.total_height())
+        elif unit == "pages":
+            self.top += int(amount) * self.canvas.winfo_height()
+        else:
+            self.top += int(amount) * HISTORY_ROW_HEIGHT
+        self.render()
+
+    def scroll(self, pixels):
+        self.top += pixels
+        self.render()
+
+    def reset(self):
+        # The list behind get_operations was replaced wholesale (a new search result).
+        self.expanded = {}
+        for row in self.rows:
+            row.index = None
+        self.render()
+
+    def toggle(self, index):
+        if index in self.expanded:
+            del self.expanded[index]
+        else:
+            self.expanded[index] = len(self.get_operations()[index].items) * HISTORY_ITEM_HEIGHT + 6
+        self.render()
+
+    def on_ledger_change(self, action, index, count=1):
+        # Only rows at or after `index` change identity; rows showing newer operations keep
+        # their widgets, so appending one operation configures exactly one row.
+        ops = self.get_operations()
+        if action == "update":
+            if index in self.expanded:
+                self.expanded[index] = len(ops[index].items) * HISTORY_ITEM_HEIGHT + 6
+        elif action == "insert":
+            # Keep the viewport on the same operations when rows appear above it.
+            if self.row_y(len(ops) - index - count) < self.top:
+                self.top += count * HISTORY_ROW_HEIGHT
+            self.expanded = {i + count if i >= index else i: extra for i, extra in self.expanded.items()}
+        elif action == "remove":
+            removed = range(index, index + count)
+            if self.row_y(len(ops) - index) < self.top:
+                self.top -= count * HISTORY_ROW_HEIGHT + sum(self.expanded.get(i, 0) for i in removed)
+            self.expanded = {i - count if i >= index else i: extra for i, extra in self.expanded.items() if i not in removed}
+        for row in self.rows:
+            if row.index is not None and row.index >= index:
+                row.index = None
+        self.render()
+
+
+class HistoryLoader:
+    # Reads a ledger's older history from its store on a worker thread; the batches are
+    # inserted on the Tk thread. Once stopped, the worker quits after its current batch.
+    def __init__(self, ledger):
+        self.ledger = ledger
+        self.batches = queue.Queue()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            for batch in self.ledger.store.iter_older():
+                if self.stopped.is_set():
+                    return
+                self.batches.put(batch)
+            self.batches.put(None)
+        except Exception as e:
+            self.batches.put(e)
+
+
+class Profiler:
+    # Rolling timings of named sections: the last PROFILE_WINDOW samples per section, and
+    # every section over PROFILE_SLOW_MS with the sections it ran inside, so a slow frame
+    # can be traced to the code that caused it. Disabled profilers just call through.
+    def __init__(self, enabled=False, path=PROFILE_FILE):
+        self.enabled = enabled
+        self.path = path
+        self.samples = {}
+        self.slow = deque(maxlen=PROFILE_WINDOW)
+        self.stack = []
+
+    def call(self, name, fn, *args):
+        if not self.enabled:
+            return fn(*args)
+        self.stack.append(name)
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            path = " > ".join(self.stack)
+            self.stack.pop()
+            self.samples.setdefault(name, deque(maxlen=PROFILE_WINDOW)).append(elapsed)
+            if elapsed > PROFILE_SLOW_MS:
+                self.slow.append({"at": datetime.now().isoformat(timespec="milliseconds"), "section": path,
+                                  "ms": round(elapsed, 2)})
+
+    def wrap(self, name, fn):
+        if not self.enabled:
+            return fn
+        return lambda *args: self.call(name, fn, *args)
+
+    def stats(self):
+        result = {}
+        for name, samples in self.samples.items():
+            ordered = sorted(samples)
+            pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+            result[name] = {"count": len(ordered), "last": round(samples[-1], 2), "p50": pick(0.5),
+                            "p90": pick(0.9), "p99": pick(0.99), "max": round(ordered[-1], 2)}
+        return result
+
+    def dump(self, path=None):
+        with open(path or self.path, "w") as f:
+            json.dump({"created": datetime.now().isoformat(timespec="seconds"), "window": PROFILE_WINDOW,
+                       "sections": self.stats(), "slow": list(self.slow)}, f, indent=2)
+
 
 class FinanceCalcApp:
-    def __init__(self, root):
+    PROFILED = ("load_data", "save_data", "refresh_history", "refresh_items", "refresh_item_tree",
+                "update_pending", "update_chart", "update_graph")
+
+    def __init__(self, root, profile=PROFILE):
         self.root = root
         self.root.title("Finance Tracker")
         self.root.resizable(False, False)
         self.root.geometry("1000x800")
         self.root.configure(background="#323232")
-        self.balance = 0
+        self.profiler = Profiler(bool(profile))
+        for name in self.PROFILED:
+            setattr(self, name, self.profiler.wrap(name, getattr(self, name)))
+        self.accounts = Accounts()
+        self.account = MAIN_ACCOUNT
+        self.account_selector = None
+        self.account_tree = None
+        self.account_period = None
+        self.ledger = Ledger()
         self.pending = 0
+        self.pending_job = None
+        self.list_shown = None
         self.list_buttons_frame = None
         self.list_cost_label = None
         self.list_btn_ok = None
@@ -134,17 +2805,33 @@ class FinanceCalcApp:
         self.type_selector = None
         self.list_frame = None
         self.item_tree = None
+        self.item_columns = None
+        self.item_rows = {}
+        self.item_keys = {}
+        self.item_stripes = {}
+        self.item_sort = None
+        self.item_tree_drawn = None
+        self.item_tree_job = None
         self.account_frame = None
-        self.history_frame = None
-        self.available_items = []
-        self.available_types = []
-        self.item_list = []
-        self.operations = []
+        self.history_view = None
+        self.loaders = {}
+        self.autosave = None
+        self.autosave_done = []
+        self.autosave_at = time.monotonic()
+        self.chart_period = None
+        self.chart_figure = None
+        self.chart_axes = None
+        self.chart_canvas = None
+        self.chart_drawn = None
+        self.graph_axes = None
+        self.graph_line = None
+        self.graph_canvas = None
+        self.graph_drawn = None
 
         self.s1 = ttk.Style()
         self.s1.theme_use("default")
         self.s1.configure("Custom.TCombobox", font=("Arial", 20), padding=1, arrowsize=20)
-        self.balance_var.set(f"Balance: {float(self.balance / 100):.2f} ₽")
+        self.balance_var.set(f"Balance: {float(self.ledger.balance / 100):.2f} ₽")
 
         style = ttk.Style()
         style.theme_use("default")
@@ -161,12 +2848,29 @@ class FinanceCalcApp:
         self.setup_tab_history()
         self.setup_tab_pie()
         self.setup_tab_graph()
+        self.setup_tab_accounts()
         root.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self.start_history_loader()
+        self.root.after(AUTOSAVE_POLL_MS, self.autosave_tick)
+        if self.profiler.enabled:
+            root.bind("<F12>", lambda e: self.profiler.dump())
+            self.perf_overlay = None
+            if profile == "overlay":
+                self.perf_overlay = tk.Label(root, font=("Consolas", 9), justify="left", anchor="ne", fg="#9fe09f", bg="#202020")
+                self.perf_overlay.place(relx=1.0, y=0, anchor="ne")
+                self.update_perf_overlay()
 
     def setup_tab_main(self):
         tab = tk.Frame(self.notebook, bg="#323232")
-        self.account_frame = tk.LabelFrame(tab, fg="white", bg="#323232")
+        self.account_frame = tk.LabelFrame(tab, text=f"{ACCOUNT}: {self.account}", fg="white", bg="#323232")
         self.account_frame.pack(fill="x", padx=2, pady=2)
+        switch_frame = tk.Frame(self.account_frame, bg="#323232")
+        switch_frame.pack(anchor="ne", padx=5)
+        self.account_selector = ttk.Combobox(switch_frame, values=self.accounts.names(), state="readonly", width=15)
+        self.account_selector.set(self.account)
+        self.account_selector.pack(side="left")
+        self.account_selector.bind("<<ComboboxSelected>>", lambda e: self.switch_account(self.account_selector.get()))
+        tk.Button(switch_frame, text="+", width=3, command=self.create_account).pack(side="left", padx=5)
         tk.Label(self.account_frame, textvariable=self.balance_var, font=("Arial", 20), fg="white", bg="#323232").pack(pady=5)
         income_frame = tk.Frame(self.account_frame, bg="#323232")
         income_frame.pack(pady=5)
@@ -180,12 +2884,12 @@ class FinanceCalcApp:
         select_frame = tk.Frame(tab, bg="#323232")
         select_frame.pack(pady=5)
         tk.Label(select_frame, text=ITEM, font=("Arial", 20), fg="white", bg="#323232").pack(side="left")
-        self.item_selector = ttk.Combobox(select_frame, values=[item.name for item in self.available_items], style="Custom.TCombobox", font=("Arial", 20), height=20, width=15)
+        self.item_selector = ttk.Combobox(select_frame, values=self.ledger.catalog.names(), style="Custom.TCombobox", font=("Arial", 20), height=20, width=15)
         self.item_selector.set("")
         self.item_selector.pack(side="left")
         self.item_selector.bind("<<ComboboxSelected>>", self.item_change)
         tk.Label(select_frame, text=TYPE, font=("Arial", 20), fg="white", bg="#323232").pack(side="left")
-        self.type_selector = ttk.Combobox(select_frame, values=[item for item in self.available_types], style="Custom.TCombobox", font=("Arial", 20), height=20, width=12)
+        self.type_selector = ttk.Combobox(select_frame, values=self.ledger.catalog.type_names(), style="Custom.TCombobox", font=("Arial", 20), height=20, width=12)
         self.type_selector.set("")
         self.type_selector.pack(side="left")
         tk.Label(select_frame, text=PRICE, font=("Arial", 20), fg="white", bg="#323232").pack(side="left")
@@ -225,131 +2929,472 @@ class FinanceCalcApp:
 
 
         columns = (ITEM, TYPE, PRICE, "Total purchased", "Week", "Month", "Year")
+        self.item_columns = columns
         self.item_tree = ttk.Treeview(tab, columns=columns, show="headings", style="Treeview")
         self.item_tree.pack(fill="both", expand=True)
         for col in columns:
-            self.item_tree.heading(col, text=col)
+            self.item_tree.heading(col, text=col, command=lambda col=col: self.sort_item_tree(col))
             if col == ITEM:
                 self.item_tree.column(col, anchor="center", width=180)
             else:
                 self.item_tree.column(col, anchor="center", width=100)
+        self.item_tree.tag_configure(ITEM_TREE_STRIPES[0], background="#333333")
+        self.item_tree.tag_configure(ITEM_TREE_STRIPES[1], background="#3a3a3a")
 
-        for i in self.available_items:
-            bg = "#333333" if self.available_items.index(i) % 2 == 0 else "#3a3a3a"
-            self.item_tree.insert("", "end", values=(i.name, i.item_type, i.price, i.count), tags=(f'row{i}',))
-            self.item_tree.tag_configure(f'row{i}', background=bg)
+        self.refresh_item_tree()
+        self.notebook.add(tab, text=ITEMS)
 
+    def refresh_item_tree(self):
+        # Rows are keyed by item name ("i" + name as the iid, since "" is the tree root) and
+        # diffed against what is shown: changed rows are updated in place, new ones inserted
+        # ITEM_TREE_BATCH per idle pass.
+        today = datetime.now().date()
+        key = (id(self.ledger), self.ledger.rollup.version, self.ledger.catalog.version, today)
+        if key == self.item_tree_drawn:
+            return
+        self.item_tree_drawn = key
+        if self.item_tree_job is not None:
+            self.root.after_cancel(self.item_tree_job)
+            self.item_tree_job = None
+        rollup = self.ledger.rollup
+        rows = {}
+        self.item_keys = {}
+        for i in self.ledger.catalog.items.values():
+            total = rollup.total(i.name)
+            windows = rollup.window_totals(i.name, today)
+            iid = "i" + i.name
+            rows[iid] = (i.name, i.item_type, i.price, f"{total[0]} ({from_cents(total[1]):.2f})",
+                            *(f"{count} ({from_cents(spend):.2f})" for count, spend in windows))
+            self.item_keys[iid] = (i.name.lower(), i.item_type.lower(), i.price, tuple(total), *map(tuple, windows))
+        gone = [iid for iid in self.item_rows if iid not in rows]
+        if gone:
+            self.item_tree.delete(*gone)
+            for iid in gone:
+                del self.item_rows[iid]
+                del self.item_stripes[iid]
+            self.stripe_item_tree()
+        new = []
+        for iid, values in rows.items():
+            shown = self.item_rows.get(iid)
+            if shown is None:
+                new.append((iid, values))
+            elif shown != values:
+                self.item_tree.item(iid, values=values)
+                self.item_rows[iid] = values
+        self.fill_item_tree(new)
 
+    def fill_item_tree(self, rows):
+        self.item_tree_job = None
+        for iid, values in rows[:ITEM_TREE_BATCH]:
+            tag = ITEM_TREE_STRIPES[len(self.item_rows) % 2]
+            self.item_tree.insert("", "end", iid=iid, values=values, tags=(tag,))
+            self.item_rows[iid] = values
+            self.item_stripes[iid] = tag
+        if len(rows) > ITEM_TREE_BATCH:
+            self.item_tree_job = self.root.after_idle(self.fill_item_tree, rows[ITEM_TREE_BATCH:])
+        elif self.item_sort is not None:
+            self.apply_item_sort()
 
-        self.notebook.add(tab, text=ITEMS)
+    def stripe_item_tree(self):
+        # Rows keep one of two shared tags; only rows whose parity changed are retagged.
+        for n, iid in enumerate(self.item_tree.get_children()):
+            tag = ITEM_TREE_STRIPES[n % 2]
+            if self.item_stripes[iid] != tag:
+                self.item_tree.item(iid, tags=(tag,))
+                self.item_stripes[iid] = tag
+
+    def sort_item_tree(self, column):
+        # A second click on the same heading reverses the order.
+        self.item_sort = (column, self.item_sort == (column, False))
+        self.apply_item_sort()
+
+    def apply_item_sort(self):
+        column, reverse = self.item_sort
+        c = self.item_columns.index(column)
+        keys = self.item_keys
+        order = sorted(self.item_rows, key=lambda iid: keys[iid][c], reverse=reverse)
+        shown = list(self.item_tree.get_children())
+        if shown == order:
+            return
+        # Only rows out of place are moved, so a re-sort after a few changes stays cheap.
+        for n, iid in enumerate(order):
+            if shown[n] != iid:
+                self.item_tree.move(iid, "", n)
+                shown.remove(iid)
+                shown.insert(n, iid)
+        self.stripe_item_tree()
 
     def setup_tab_history(self):
         tab = tk.Frame(self.notebook, bg="#323232")
-        canvas = tk.Canvas(tab, bg="#323232", highlightthickness=0)
-        scrollbar = tk.Scrollbar(tab, orient="vertical", command=canvas.yview)
-        canvas.configure(yscrollcommand=scrollbar.set)
-        canvas.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
-        self.history_frame = tk.Frame(canvas, bg="#323232")
-        self.history_frame.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
-        history_window = canvas.create_window((0, 0), window=self.history_frame, anchor="nw")
-
-        def resize_frame(event):
-            canvas.itemconfig(history_window, width=event.width)
+        bar = tk.Frame(tab, bg="#323232")
+        bar.pack(side="top", fill="x", padx=10, pady=5)
+        self.search_text = tk.Entry(bar, font=("Arial", 12), width=16)
+        self.search_kind = ttk.Combobox(bar, values=SEARCH_KINDS, state="readonly", width=10)
+        self.search_kind.set(SEARCH_KINDS[0])
+        self.search_min = tk.Entry(bar, font=("Arial", 12), width=8)
+        self.search_max = tk.Entry(bar, font=("Arial", 12), width=8)
+        self.search_from = tk.Entry(bar, font=("Arial", 12), width=10)
+        self.search_to = tk.Entry(bar, font=("Arial", 12), width=10)
+        for label, widget in (("Item", self.search_text), ("Kind", self.search_kind), ("Amount", self.search_min),
+                              ("-", self.search_max), ("Date", self.search_from), ("-", self.search_to)):
+            tk.Label(bar, text=label, fg="white", bg="#323232").pack(side="left", padx=2)
+            widget.pack(side="left", padx=2)
+            widget.bind("<Return>", lambda e: self.search_history())
+        tk.Button(bar, text="Search", command=self.search_history).pack(side="left", padx=5)
+        tk.Button(bar, text="Clear", command=self.clear_search).pack(side="left")
+        self.search_count = tk.Label(bar, fg="white", bg="#323232")
+        self.search_count.pack(side="left", padx=5)
+        self.history_results = None
+        self.history_view = HistoryView(tab, lambda: self.ledger.operations if self.history_results is None else self.history_results)
+        self.ledger.subscribe(self.on_history_change)
+        self.notebook.add(tab, text="History")
 
-        canvas.bind("<Configure>", resize_frame)
+    def refresh_history(self):
+        self.history_view.render()
 
-        def _on_mousewheel(event):
-            canvas.yview_scroll(int(-1 * (event.delta / 120)), "units")
+    def on_history_change(self, action, index, count=1):
+        if self.history_results is None:
+            self.history_view.on_ledger_change(action, index, count)
+        elif action == "insert" and self.ledger in self.loaders:
+            # Batches from the loader only move the matches; the search runs again over
+            # the whole history once loading is done.
+            self.history_results.shift(index, count)
+        else:
+            self.search_history()
 
-        canvas.bind_all("<MouseWheel>", _on_mousewheel)
-        self.refresh_history()
-        self.notebook.add(tab, text="History")
+    def search_history(self):
+        try:
+            low = to_cents(float(self.search_min.get())) if self.search_min.get().strip() else None
+            high = to_cents(float(self.search_max.get())) if self.search_max.get().strip() else None
+            start = parse_date(self.search_from.get().strip()) if self.search_from.get().strip() else None
+            end = parse_date(self.search_to.get().strip()) + timedelta(days=1) if self.search_to.get().strip() else None
+        except (ValueError, OverflowError):
+            self.search_count.configure(text="Invalid amount or date")
+            return
+        kind = self.search_kind.get()
+        positions = self.ledger.search(self.search_text.get().strip(), None if kind == SEARCH_KINDS[0] else kind,
+                                       low, high, start, end)
+        self.history_results = SearchResult(self.ledger.operations, positions)
+        self.search_count.configure(text=f"{len(positions)} found")
+        self.history_view.reset()
 
-    def refresh_history(self):
-        for widget in self.history_frame.winfo_children():
-            widget.destroy()
-        for op in reversed(self.operations):
-            base = f"[{op.timestamp.strftime('%Y-%m-%d %H:%M')}] {op.kind}: {op.amount:.2f} ₽   Balance: {op.balance:.2f} ₽"
-            op_frame = tk.Frame(self.history_frame, bg="#3a3a3a")
-            op_frame.pack(fill="x", padx=10, pady=3)
-            tk.Label(op_frame, text=base, fg="white", bg="#3a3a3a").pack(side="left")
-            if op.items:
-                def toggle(frame=op_frame, items=op.items):
-                    if hasattr(frame, 'expanded') and frame.expanded:
-                        for w in frame.extra:
-                            w.destroy()
-                        frame.expanded = False
-                    else:
-                        frame.extra = [tk.Label(frame, text=f"  - {i.name} ({i.count}) ({from_cents(i.price * i.count):.2f})", fg="white", bg="#444") for i in items]
-                        for w in frame.extra:
-                            w.pack(anchor="w")
-                        frame.expanded = True
-                tk.Button(op_frame, text="Expand", command=toggle, fg="white", bg="#323232").pack(side="right")
+    def clear_search(self):
+        for entry in (self.search_text, self.search_min, self.search_max, self.search_from, self.search_to):
+            entry.delete(0, tk.END)
+        self.search_kind.set(SEARCH_KINDS[0])
+        self.search_count.configure(text="")
+        self.history_results = None
+        self.history_view.reset()
 
     def setup_tab_pie(self):
         tab = tk.Frame(self.notebook, bg="#323232")
-
+        self.chart_period = ttk.Combobox(tab, values=list(CHART_PERIODS), state="readonly", width=10)
+        self.chart_period.set("Month")
+        self.chart_period.pack(pady=5)
+        self.chart_period.bind("<<ComboboxSelected>>", self.update_chart)
+        self.chart_all = tk.BooleanVar()
+        tk.Checkbutton(tab, text="All accounts", variable=self.chart_all, command=self.update_chart, fg="white",
+                       bg="#323232", selectcolor="#323232", activebackground="#323232").pack()
+        self.chart_figure = Figure(figsize=(7, 5), facecolor="#323232")
+        self.chart_axes = self.chart_figure.add_subplot()
+        self.chart_canvas = FigureCanvasTkAgg(self.chart_figure, master=tab)
+        self.chart_canvas.get_tk_widget().pack(fill="both", expand=True)
         self.notebook.add(tab, text="Chart")
 
-    def setup_tab_graph(self):
+    def update_chart(self, event=None):
+        today = datetime.now().date()
+        members = self.accounts.members().values() if self.chart_all.get() else [self.ledger]
+        key = (tuple((id(member), member.type_spend.version) for member in members), self.chart_period.get(), today)
+        if key == self.chart_drawn:
+            return
+        self.chart_drawn = key
+        days = CHART_PERIODS[self.chart_period.get()]
+        start = None if days is None else today - timedelta(days=days - 1)
+        spend = self.accounts.spend_by_type(start) if self.chart_all.get() else self.ledger.type_spend.spend_since(start)
+        spend = sorted(((v, k) for k, v in spend.items() if v > 0), reverse=True)
+        ax = self.chart_axes
+        ax.clear()
+        if spend:
+            ax.pie([v for v, k in spend], labels=[f"{k} ({from_cents(v):.2f})" for v, k in spend],
+                   autopct="%1.1f%%", startangle=90, counterclock=False, textprops={"color": "white"})
+            ax.axis("equal")
+        else:
+            ax.text(0.5, 0.5, "No purchases", color="white", ha="center", va="center", transform=ax.transAxes)
+            ax.axis("off")
+        self.chart_canvas.draw_idle()
+
+    def setup_tab_accounts(self):
         tab = tk.Frame(self.notebook, bg="#323232")
+        self.account_period = ttk.Combobox(tab, values=list(CHART_PERIODS), state="readonly", width=10)
+        self.account_period.set("Month")
+        self.account_period.pack(pady=5)
+        self.account_period.bind("<<ComboboxSelected>>", lambda e: self.update_accounts())
+        columns = ("Balance", "Spent", "Net flow")
+        self.account_tree = ttk.Treeview(tab, columns=columns, show="tree headings", style="Treeview")
+        self.account_tree.heading("#0", text=ACCOUNT)
+        for col in columns:
+            self.account_tree.heading(col, text=col)
+            self.account_tree.column(col, anchor="center", width=150)
+        self.account_tree.tag_configure("total", font=("Segoe UI", 12, "bold"))
+        self.account_tree.bind("<Double-1>", self.on_account_activate)
+        self.account_tree.pack(fill="both", expand=True)
+        self.notebook.add(tab, text="Accounts")
+
+    def update_accounts(self):
+        # Consolidated figures come from each ledger's aggregates, not from merged histories.
+        days = CHART_PERIODS[self.account_period.get()]
+        today = datetime.now()
+        start = None if days is None else datetime(today.year, today.month, today.day) - timedelta(days=days - 1)
+        self.account_tree.delete(*self.account_tree.get_children())
+        for row in self.accounts.totals(start):
+            self.account_tree.insert("", "end", text=row["account"], tags=("total",) if row["account"] == "Total" else (),
+                                     values=[f"{from_cents(row[key]):.2f}" for key in ("balance", "spent", "net")])
+
+    def on_account_activate(self, event):
+        name = self.account_tree.item(self.account_tree.focus(), "text")
+        if name in self.accounts.members():
+            self.account_selector.set(name)
+            self.switch_account(name)
+
+    def switch_account(self, name):
+        if name == self.account:
+            return
+        # The old ledger keeps loading its history in the background; only the view stops
+        # following it.
+        self.ledger.unsubscribe(self.on_history_change)
+        self.account = name
+        if name not in self.accounts.ledgers:
+            self.accounts.open(name, RECENT_OPERATIONS)
+        self.ledger = self.accounts.ledgers[name]
+        if self.on_history_change not in self.ledger.listeners:
+            self.ledger.subscribe(self.on_history_change)
+        self.account_frame.configure(text=f"{ACCOUNT}: {name}")
+        self.chart_drawn = None
+        self.graph_drawn = None
+        self.history_results = None
+        self.history_view.top = 0
+        self.history_view.reset()
+        self.refresh_items()
+        self.update_pending()
+        self.show_tab(self.notebook.tab(self.notebook.select(), "text"))
+        self.start_history_loader()
 
+    def create_account(self):
+        name = simpledialog.askstring(ACCOUNT, "New account name:", parent=self.root)
+        if not name:
+            return
+        try:
+            self.accounts.create(name)
+        except (ValueError, OSError):
+            return
+        self.account_selector.config(values=self.accounts.names())
+        self.account_selector.set(name.strip())
+        self.switch_account(name.strip())
+
+    def setup_tab_graph(self):
+        tab = tk.Frame(self.notebook, bg="#323232")
+        figure = Figure(figsize=(7, 5), facecolor="#323232")
+        self.graph_axes = figure.add_subplot()
+        self.graph_axes.set_facecolor("#2b2b2b")
+        self.graph_axes.tick_params(colors="white")
+        self.graph_axes.xaxis_date()
+        self.graph_line, = self.graph_axes.plot([], [], color="#4a9eda", drawstyle="steps-post")
+        self.graph_canvas = FigureCanvasTkAgg(figure, master=tab)
+        toolbar = NavigationToolbar2Tk(self.graph_canvas, tab)
+        toolbar.update()
+        self.graph_canvas.get_tk_widget().pack(fill="both", expand=True)
+        self.graph_axes.callbacks.connect("xlim_changed", self.on_graph_zoom)
+        self.graph_canvas.mpl_connect("resize_event", lambda event: self.on_graph_zoom(self.graph_axes))
         self.notebook.add(tab, text="Graph")
 
+    def update_graph(self):
+        series = self.ledger.balance_series
+        key = (id(series), series.version)
+        if self.graph_drawn == key:
+            return
+        self.graph_drawn = key
+        if len(series.x):
+            x, y = series.visible(-np.inf, np.inf, self.graph_axes.bbox.width)
+            self.graph_line.set_data(x, y)
+        else:
+            self.graph_line.set_data([], [])
+        self.graph_axes.relim()
+        self.graph_axes.autoscale_view()
+        self.graph_canvas.draw_idle()
+
+    def on_graph_zoom(self, ax):
+        # Re-sample only the visible range so zoomed views regain full detail. The axes'
+        # own pixel width is known before the widget is first mapped and follows resizes.
+        xmin, xmax = ax.get_xlim()
+        x, y = self.ledger.balance_series.visible(xmin, xmax, ax.bbox.width)
+        self.graph_line.set_data(x, y)
+        self.graph_canvas.draw_idle()
+
     def on_closing(self):
+        # Incremental stores close with part of their history loaded, so their loaders are
+        # dropped; a changed whole-file ledger is written whole and needs the rest first.
+        for loader in list(self.loaders.values()):
+            if loader.ledger.dirty and not loader.ledger.store.incremental:
+                while loader.ledger in self.loaders:
+                    self.take_history_batch(loader, loader.batches.get())
+            else:
+                loader.stopped.set()
+        self.loaders = {}
+        if self.autosave is not None:
+            self.finish_autosave()
         self.save_data()
+        if self.profiler.enabled:
+            self.profiler.dump()
         main_window.destroy()
 
-    def save_data(self):
-        with open("fc_data.json", "w") as f:
-            json.dump({
-                "balance": self.balance,
-                "item_list": [item.__dict__ for item in self.item_list],
-                "item_types": [item for item in self.available_types],
-                "items": [item.__dict__ for item in self.available_items],
-                "history": [op.to_dict() for op in self.operations]
+    def update_perf_overlay(self):
+        stats = sorted(self.profiler.stats().items(), key=lambda kv: -kv[1]["p90"])[:6]
+        lines = [f"{name[:18]:<18} {s['last']:7.1f} {s['p50']:7.1f} {s['p90']:7.1f}" for name, s in stats]
+        self.perf_overlay.configure(text="\n".join([f"{'ms':<18} {'last':>7} {'p50':>7} {'p90':>7}"] + lines))
+        self.perf_overlay.lift()
+        self.root.after(PROFILE_OVERLAY_MS, self.update_perf_overlay)
+
+    def save_data(self, ledgers=None):
+        # Every save the app makes goes through here, so it is profiled under one name.
+        # Without ledgers it is the final save on exit; otherwise incremental stores
+        # checkpoint now and whole-file stores are snapshotted for the autosave worker.
+        if ledgers is None:
+            self.accounts.close()
+            return
+        jobs = []
+        for ledger in ledgers:
+            if ledger.store.incremental:
+                self.profiler.call("autosave", ledger.checkpoint)
+            if not ledger.store.incremental or ledger.store.compact_due:
+                jobs.append((ledger,) + self.profiler.call("snapshot", ledger.snapshot))
+        if jobs:
+            self.autosave = threading.Thread(target=self.autosave_worker, args=(jobs,), daemon=True)
+            self.autosave.start()
 
-            }, f, indent=2)
+    def autosave_tick(self):
+        # Saves once changes have been quiet for AUTOSAVE_IDLE_MS, or every AUTOSAVE_MS
+        # while they keep coming. Whole-file stores are written from a snapshot on a worker
+        # thread; incremental stores checkpoint the basket and catalog here, and compact
+        # from a snapshot on the worker when their log has grown enough.
+        self.root.after(AUTOSAVE_POLL_MS, self.autosave_tick)
+        if self.autosave is not None:
+            if self.autosave.is_alive():
+                return
+            error = self.finish_autosave()
+            if error is not None:
+                raise error
+        # A partly loaded whole-file ledger would be saved without its older history.
+        ledgers = [ledger for ledger in self.accounts.ledgers.values()
+                   if ledger.dirty and (ledger.store.complete or ledger.store.incremental)]
+        if not ledgers:
+            return
+        now = time.monotonic()
+        if (now - max(ledger.changed_at for ledger in ledgers) < AUTOSAVE_IDLE_MS / 1000
+                and now - self.autosave_at < AUTOSAVE_MS / 1000):
+            return
+        self.autosave_at = now
+        self.save_data(ledgers)
+
+    def autosave_worker(self, jobs):
+        for ledger, mark, state in jobs:
+            try:
+                ledger.store.save_snapshot(state)
+                self.autosave_done.append((ledger, mark, None))
+            except Exception as e:
+                self.autosave_done.append((ledger, None, e))
+
+    def finish_autosave(self):
+        # Back on the Tk thread: saved ledgers are marked clean (unless they changed since
+        # the snapshot); failed ones stay dirty and are retried on a later tick.
+        self.autosave.join()
+        self.autosave = None
+        done, self.autosave_done = self.autosave_done, []
+        error = None
+        for ledger, mark, e in done:
+            if e is None:
+                ledger.saved_snapshot(mark)
+            else:
+                ledger.operations.release()
+                error = e
+        return error
 
     def load_data(self):
-        if os.path.exists("fc_data.json"):
-            with open("fc_data.json", "r") as f:
-                data = json.load(f)
-                self.balance = data.get("balance", 0)
-                self.item_list = [Item(**item) for item in data.get("item_list", [])]
-                self.available_types = data.get("item_types", [])
-                self.operations = [Operation.from_dict(op) for op in data.get("history", [])]
-                self.available_items = [Item(**item) for item in data.get("items", [])]
+        # The active account loads its recent history now and the rest in the background;
+        # other accounts are summarized by worker processes meanwhile, for the Accounts
+        # tab and the all-accounts chart, and opened when switched to.
+        self.ledger.load(RECENT_OPERATIONS)
+        self.accounts.adopt(MAIN_ACCOUNT, self.ledger)
+        others = self.accounts.names()[1:]
+        if others:
+            self.accounts.start_summaries(others)
+            self.root.after(LOAD_POLL_MS, self.poll_summaries)
+
+    def poll_summaries(self):
+        if self.accounts.collect():
+            tab = self.notebook.tab(self.notebook.select(), "text")
+            if tab == "Accounts" or tab == "Chart":
+                self.show_tab(tab)
+        if self.accounts.pending:
+            self.root.after(LOAD_POLL_MS, self.poll_summaries)
+
+    def start_history_loader(self):
+        # One loader per ledger, so switching accounts never waits for a previous one.
+        if self.ledger.store.complete or self.ledger in self.loaders:
+            return
+        if not self.loaders:
+            self.root.after(LOAD_POLL_MS, self.poll_history_loader)
+        self.loaders[self.ledger] = HistoryLoader(self.ledger)
+
+    def poll_history_loader(self):
+        # One batch per loader per tick keeps the mainloop responsive while older history
+        # streams in.
+        for loader in list(self.loaders.values()):
+            try:
+                batch = loader.batches.get_nowait()
+            except queue.Empty:
+                continue
+            self.take_history_batch(loader, batch)
+        if self.loaders:
+            self.root.after(LOAD_POLL_MS, self.poll_history_loader)
+
+    def take_history_batch(self, loader, batch):
+        ledger = loader.ledger
+        if isinstance(batch, Exception):
+            del self.loaders[ledger]
+            raise batch
+        if batch is None:
+            del self.loaders[ledger]
+            ledger.store.complete = True
+            if ledger is self.ledger and self.history_results is not None:
+                self.search_history()
+            return
+        ledger.insert_older(batch)
 
     def add_income(self):
         try:
-            amount = int(float(self.income_amount.get()) * 100.0)
-        except ValueError:
+            amount = to_cents(float(self.income_amount.get()))
+        except (ValueError, OverflowError):
             return
-        if self.income_type.get() == "Set":
-            b1 = self.balance
-            self.balance = amount
-            self.operations.append(Operation("Set balance", from_cents(self.balance - b1), from_cents(self.balance)))
-        else:
-            self.balance += amount
-            if amount > 0:
-                self.operations.append(Operation("Income ("+self.income_type.get()+")", from_cents(amount), from_cents(self.balance)))
-            else:
-                self.operations.append(Operation("Expense (" + self.income_type.get() + ")", from_cents(amount), from_cents(self.balance)))
+        self.ledger.add_income(amount, self.income_type.get())
         self.income_amount.delete(0, tk.END)
         self.update_main_tab()
-        self.refresh_history()
 
     def update_main_tab(self):
-        if self.pending > 0:
-            self.balance_var.set(f"Balance: {float(self.balance / 100):.2f} ({float((self.balance - self.pending) / 100):.2f}) ₽")
-            self.list_cost_label.pack(side="left")
+        shown = self.pending > 0
+        if shown:
+            self.balance_var.set(f"Balance: {float(self.ledger.balance / 100):.2f} ({float((self.ledger.balance - self.pending) / 100):.2f}) ₽")
             self.list_cost_label.configure(text=f"Cost: {float(self.pending / 100):.2f} ₽")
+        else:
+            self.balance_var.set(f"Balance: {float(self.ledger.balance / 100):.2f} ₽")
+        # Re-packing only when visibility flips keeps geometry passes out of typing.
+        if shown == self.list_shown:
+            return
+        self.list_shown = shown
+        if shown:
+            self.list_cost_label.pack(side="left")
             self.list_btn_ok.pack(side="left", padx=5)
             self.list_btn_cancel.pack(side="left", padx=5)
         else:
-            self.balance_var.set(f"Balance: {float(self.balance / 100):.2f} ₽")
             self.list_cost_label.pack_forget()
             self.list_btn_ok.pack_forget()
             self.list_btn_cancel.pack_forget()
@@ -357,85 +3402,195 @@ class FinanceCalcApp:
     def add_item(self):
         i1 = Item(self.item_selector.get(), self.type_selector.get(), to_cents(float(self.item_price_input.get())))
         ItemGUI(self.list_frame, self, i1)
-        self.item_list.append(i1)
+        new_type, new_name, changed = self.ledger.add_to_basket(i1)
         self.update_pending()
-        match = False
-        for t in self.available_types:
-            if i1.item_type == t:
-                match = True
-                break
-        if not match:
-            self.available_types.append(i1.item_type)
-            self.type_selector.config(values=[item for item in self.available_types])
-        for item in self.available_items:
-            if item.name == i1.name:
-                item.item_type = i1.item_type
-                item.price = i1.price
-                return
-        self.available_items.append(i1)
-        self.item_selector.config(values=[item.name for item in self.available_items])
+        if new_type:
+            self.type_selector.config(values=self.ledger.catalog.type_names())
+        if new_name:
+            self.item_selector.config(values=self.ledger.catalog.names())
 
     def check_out(self):
-        self.balance -= self.pending
-        self.operations.append(Operation("Purchase", from_cents(self.pending), from_cents(self.balance), None, self.item_list.copy()))
+        self.ledger.check_out()
         for widget in self.list_frame.winfo_children():
             widget.destroy()
-        self.item_list.clear()
         self.update_pending()
-        self.refresh_history()
 
     def dismiss_list(self):
         for widget in self.list_frame.winfo_children():
             widget.destroy()
-        self.item_list.clear()
+        self.ledger.clear_basket()
         self.update_pending()
 
+    def request_pending(self):
+        # Coalesces bursts of basket edits (one per keystroke) into one refresh per idle pass.
+        if self.pending_job is None:
+            self.pending_job = self.root.after_idle(self.update_pending)
+
     def update_pending(self):
-        self.pending = 0
-        for item in self.item_list:
-            self.pending += item.price * item.count
+        if self.pending_job is not None:
+            self.root.after_cancel(self.pending_job)
+            self.pending_job = None
+        self.pending = self.ledger.pending()
         self.update_main_tab()
-        if len(self.item_list) > 17:
+        if len(self.ledger.item_list) > 17:
             self.root.resizable(False, True)
 
     def on_tab_selected(self, event):
-        selected_tab = event.widget.select()
-        tab_index = event.widget.index(selected_tab)
-        tab_name = self.notebook.tab(selected_tab, "text")
+        tab_name = self.notebook.tab(event.widget.select(), "text")
+        self.profiler.call("tab " + tab_name, self.show_tab, tab_name)
 
+    def show_tab(self, tab_name):
         if tab_name == "History":
-            print("History tab selected")
             self.refresh_history()
-        elif tab_name == "Main":
-            print("Main tab selected")
         elif tab_name == "Items":
-            print("Items tab selected")
             self.refresh_items()
+            self.refresh_item_tree()
         elif tab_name == "Chart":
-            print("Chart tab selected")
-            # self.update_chart()  ← if you add such a method
+            self.update_chart()
         elif tab_name == "Graph":
-            print("Graph tab selected")
-            # self.update_graph()  ← if you add such a method
+            self.update_graph()
+        elif tab_name == "Accounts":
+            self.update_accounts()
 
     def item_change(self, event):
-        if len(self.available_items) < 1:
-            return
-        input_v = self.item_selector.get()
-        for item in self.available_items:
-            if item.name == input_v:
-                self.type_selector.set(item.item_type)
-                self.item_price_input.delete(0, tk.END)
-                self.item_price_input.insert(tk.END, f"{float(item.price / 100):.2f}")
-                return
+        item = self.ledger.catalog.get(self.item_selector.get())
+        if item is None:
+            return
+        self.type_selector.set(item.item_type)
+        self.item_price_input.delete(0, tk.END)
+        self.item_price_input.insert(tk.END, f"{float(item.price / 100):.2f}")
 
     def refresh_items(self):
         for widget in self.list_frame.winfo_children():
             widget.destroy()
-        for i, item in enumerate(self.item_list):
+        for i, item in enumerate(self.ledger.item_list):
             ItemGUI(self.list_frame, self, item)
 
+def parse_date(value):
+    return datetime.fromisoformat(value)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="FinTrack", description="Headless FinTrack ledger tools. Run without arguments for the UI.")
+    parser.add_argument("--storage", choices=["json", "journal", "sqlite", "binary"], default=STORAGE_MODE)
+    parser.add_argument("--account", default=MAIN_ACCOUNT, help=f"account under {ACCOUNTS_DIR}/, {MAIN_ACCOUNT} by default")
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("import", help="append a bank statement CSV to the ledger")
+    p.add_argument("csv")
+    p.add_argument("--date-column", default="date")
+    p.add_argument("--amount-column", default="amount")
+    p.add_argument("--category-column", default="category")
+    p.add_argument("--date-format", help="strptime format, ISO dates by default")
+    p.add_argument("--delimiter", default=",")
+    p.add_argument("--decimal-comma", action="store_true")
+    commands.add_parser("recompute", help="recompute running balances from operation amounts")
+    p = commands.add_parser("report", help="export income/expense totals per period")
+    p.add_argument("--from", dest="start", type=parse_date)
+    p.add_argument("--to", dest="end", type=parse_date)
+    p.add_argument("--period", choices=["day", "week", "month", "year"], default="month")
+    p.add_argument("--format", choices=["csv", "json"], default="csv")
+    p.add_argument("-o", "--output")
+    commands.add_parser("migrate", help="copy fc_data.json into the SQLite store")
+    p = commands.add_parser("accounts", help="balance, spend and net flow of every account and in total")
+    p.add_argument("--from", dest="start", type=parse_date)
+    p = commands.add_parser("convert", help="convert between fc_data.json and the binary fc_data.bin")
+    p.add_argument("target", choices=["binary", "json"])
+    p = commands.add_parser("balance", help="balance as of a date")
+    p.add_argument("--at", type=parse_date)
+    p = commands.add_parser("flow", help="net income minus spending between two dates")
+    p.add_argument("--from", dest="start", type=parse_date)
+    p.add_argument("--to", dest="end", type=parse_date)
+    commands.add_parser("verify", help="check stored running balances against amounts")
+    p = commands.add_parser("search", help="list operations matching filters")
+    p.add_argument("--item", help="item name or type substring")
+    p.add_argument("--kind", choices=SEARCH_KINDS[1:])
+    p.add_argument("--min", type=float)
+    p.add_argument("--max", type=float)
+    p.add_argument("--from", dest="start", type=parse_date)
+    p.add_argument("--to", dest="end", type=parse_date)
+    p.add_argument("--limit", type=int, default=50, help="newest N matches, 0 for all")
+    p = commands.add_parser("edit", help="change the amount of a past operation (target balance for Set balance)")
+    p.add_argument("index", type=int)
+    p.add_argument("amount", type=float)
+    p = commands.add_parser("delete", help="delete a past operation")
+    p.add_argument("index", type=int)
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        print(f"Migrated {migrate_json_to_sqlite()} operations to {DB_FILE}")
+        return 0
+    if args.command == "convert":
+        count = convert_ledger(args.target)
+        print(f"Wrote {count} operations to {BIN_FILE if args.target == 'binary' else DATA_FILE}")
+        return 0
+    accounts = Accounts(args.storage)
+    if args.command == "accounts":
+        accounts.load()
+        for row in accounts.totals(args.start):
+            print(f"{row['account']:<20} {from_cents(row['balance']):>14.2f} {from_cents(row['spent']):>14.2f} {from_cents(row['net']):>14.2f}")
+        return 0
+    if args.account not in accounts.names():
+        parser.error(f"no account named {args.account!r}")
+    ledger = Ledger(make_store(args.storage, accounts.directory(args.account)))
+    ledger.load()
+    if args.command == "import":
+        count = ledger.import_csv(args.csv, args.date_column, args.amount_column, args.category_column,
+                                  args.date_format, args.delimiter, args.decimal_comma)
+        print(f"Imported {count} operations, balance {from_cents(ledger.balance):.2f}")
+    elif args.command == "recompute":
+        print(f"Fixed {ledger.recompute_balances()} operations, balance {from_cents(ledger.balance):.2f}")
+    elif args.command == "balance":
+        print(f"{from_cents(ledger.balance_at(args.at) if args.at else ledger.balance):.2f}")
+        return 0
+    elif args.command == "flow":
+        print(f"{from_cents(ledger.net_flow(args.start, args.end)):.2f}")
+        return 0
+    elif args.command == "search":
+        positions = ledger.search(args.item, args.kind, None if args.min is None else to_cents(args.min),
+                                  None if args.max is None else to_cents(args.max), args.start, args.end)
+        shown = positions[-args.limit:] if args.limit else positions
+        for pos in shown.tolist():
+            op = ledger.operations[pos]
+            print(f"{pos}\t{op.timestamp:%Y-%m-%d %H:%M}\t{op.kind}\t{from_cents(op.amount):.2f}\t{from_cents(op.balance):.2f}")
+        print(f"{len(positions)} found", file=sys.stderr)
+        return 0
+    elif args.command == "verify":
+        bad = ledger.verify_balances()
+        if bad:
+            print(f"{len(bad)} operations disagree with their amounts, first at {bad[0]}; run recompute to fix")
+            return 1
+        print(f"All {len(ledger.operations)} balances check out")
+        return 0
+    elif args.command == "edit":
+        op = ledger.operations[args.index]
+        if op.kind == "Set balance":
+            op.balance = to_cents(args.amount)
+        else:
+            op.amount = to_cents(args.amount)
+        ledger.edit_operation(args.index, op)
+        print(f"Balance {from_cents(ledger.balance):.2f}")
+    elif args.command == "delete":
+        op = ledger.delete_operation(args.index)
+        print(f"Deleted {op.kind} {from_cents(op.amount):.2f}, balance {from_cents(ledger.balance):.2f}")
+    elif args.command == "report":
+        rows = ledger.report(args.start, args.end, args.period)
+        out = open(args.output, "w", newline="") if args.output else sys.stdout
+        if args.format == "json":
+            json.dump(rows, out, indent=2)
+            out.write("\n")
+        else:
+            writer = csv.DictWriter(out, fieldnames=["period", "income", "expense", "purchases", "net", "balance", "operations"])
+            writer.writeheader()
+            writer.writerows(rows)
+        if args.output:
+            out.close()
+        return 0
+    ledger.close()
+    return 0
+
 if __name__ == "__main__":
+    ui_flags = {"--profile": "1", "--perf-overlay": "overlay"}
+    if any(arg not in ui_flags for arg in sys.argv[1:]):
+        sys.exit(main())
     main_window = tk.Tk()
-    app = FinanceCalcApp(main_window)
+    app = FinanceCalcApp(main_window, max((ui_flags[arg] for arg in sys.argv[1:]), key=len, default=PROFILE))
     main_window.mainloop()
\ No newline at end of file
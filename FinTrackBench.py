@@ -0,0 +1,207 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import FinTrack
+from FinTrack import Item, Ledger, from_cents, make_store
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+TYPES = ["Food", "Drinks", "Household", "Hygiene", "Transport", "Pharmacy", "Clothes", "Electronics",
+         "Pets", "Kids", "Hobby", "Books", "Garden", "Sport", "Snacks", "Bakery", "Dairy", "Meat", "Fruit", "Other"]
+
+def make_catalog(rng, size=500):
+    catalog = []
+    for i in range(size):
+        item_type = TYPES[i % len(TYPES)]
+        price = int(rng.lognormvariate(4.5, 1.0) * 100) + 100
+        catalog.append((f"{item_type} #{i // len(TYPES) + 1}", item_type, price))
+    return catalog
+
+def generate_ledger(path, count, seed=1):
+    # Streams a fc_data.json with `count` operations, one per line as JsonStore writes
+    # them: mostly purchases with 1-8 item baskets drawn from a skewed catalog, a monthly
+    # salary, some gifts and expenses and a rare balance correction.
+    rng = random.Random(seed)
+    catalog = make_catalog(rng)
+    weights = [1 / (i + 1) for i in range(len(catalog))]
+    timestamp = datetime(2015, 1, 1)
+    step = timedelta(minutes=max(1, int(5 * 365 * 24 * 60 / max(count, 1))))
+    balance = 0
+    last_salary = None
+    encode = json.JSONEncoder(separators=(",", ":")).encode
+    with open(path, "w") as f:
+        f.write('{"item_list":[],"item_types":' + encode(TYPES) + ',"items":'
+                + encode([{"name": n, "item_type": t, "price": p, "count": 1} for n, t, p in catalog])
+                + ',"history":[\n')
+        for i in range(count):
+            timestamp += step
+            month = (timestamp.year, timestamp.month)
+            if month != last_salary:
+                last_salary = month
+                amount = rng.randint(60000, 120000) * 100
+                balance += amount
+                op = {"kind": "Income (Salary)", "amount": from_cents(amount), "items": []}
+            elif rng.random() < 0.03:
+                amount = rng.randint(500, 20000) * 100
+                balance += amount
+                op = {"kind": "Income (Gift)", "amount": from_cents(amount), "items": []}
+            elif rng.random() < 0.05:
+                amount = -rng.randint(100, 30000) * 100
+                balance += amount
+                op = {"kind": "Expense (Other)", "amount": from_cents(amount), "items": []}
+            elif rng.random() < 0.002:
+                target = balance + rng.randint(-5000, 5000) * 100
+                op = {"kind": "Set balance", "amount": from_cents(target - balance), "items": []}
+                balance = target
+            else:
+                items = []
+                total = 0
+                for name, item_type, price in rng.choices(catalog, weights, k=rng.randint(1, 8)):
+                    n = rng.choice((1, 1, 1, 2, 3))
+                    items.append({"name": name, "item_type": item_type, "price": price, "count": n})
+                    total += price * n
+                balance -= total
+                op = {"kind": "Purchase", "amount": from_cents(total), "items": items}
+            op["timestamp"] = timestamp.isoformat()
+            op["balance"] = from_cents(balance)
+            f.write((",\n" if i else "") + encode(op))
+        f.write('\n],"balance":' + str(balance) + "}")
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_engine(storage, repeat):
+    results = {}
+    ledger = Ledger(make_store(storage))
+    results["load_data"] = timed(lambda: Ledger(make_store(storage)).load(), repeat)
+    results["load_head"] = timed(lambda: make_store(storage).load_head(FinTrack.RECENT_OPERATIONS), repeat)
+    ledger.load()
+    results["save_data"] = timed(ledger.save, repeat)
+    results["report_month"] = timed(lambda: ledger.report(period="month"), repeat)
+    results["recompute_balances"] = timed(lambda: ledger.operations.recompute_balances(), repeat)
+    ledger.store.close(ledger.get_state())
+    return results
+
+def bench_ui(repeat, basket=50):
+    import tkinter as tk
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return None
+    FinTrack.main_window = root
+    results = {}
+    start = time.perf_counter()
+    app = FinTrack.FinanceCalcApp(root)
+    root.update()
+    results["startup_to_first_frame"] = time.perf_counter() - start
+    app.finish_history_loader()
+    names = list(app.ledger.catalog.items.values())[:basket]
+    for item in names:
+        app.ledger.add_to_basket(Item(item.name, item.item_type, item.price))
+    results["update_pending"] = timed(app.update_pending, repeat)
+    results["refresh_items"] = timed(lambda: (app.refresh_items(), root.update_idletasks()), repeat)
+    results["refresh_history"] = timed(lambda: (app.refresh_history(), root.update_idletasks()), repeat)
+    tabs = app.notebook.tabs()
+    for tab in tabs:
+        name = app.notebook.tab(tab, "text")
+        def switch():
+            app.notebook.select(tabs[0] if tab != tabs[0] else tabs[1])
+            root.update()
+            app.notebook.select(tab)
+            root.update()
+        results[f"tab_{name.lower()}"] = timed(switch, repeat)
+    app.ledger.clear_basket()
+    root.destroy()
+    return results
+
+def compare(results, baseline, tolerance, floor):
+    regressions = []
+    for key, seconds in results.items():
+        before = baseline.get(key)
+        if before is not None and seconds > before * tolerance and seconds - before > floor:
+            regressions.append({"metric": key, "baseline": before, "seconds": seconds, "ratio": seconds / before})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark FinTrack against synthetic ledgers.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="operation counts, e.g. 10000 10000000")
+    parser.add_argument("--storage", choices=["json", "journal", "sqlite", "binary"], default="json")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-ui", action="store_true", help="skip Tk timings")
+    parser.add_argument("--output", default="fc_bench.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="allowed slowdown ratio")
+    parser.add_argument("--floor", type=float, default=0.005, help="ignore slowdowns below this many seconds")
+    parser.add_argument("--workdir", help="keep generated ledgers here instead of a temp dir")
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            data = json.load(f)
+        # Timings of different storage modes are not comparable.
+        if data.get("storage") != args.storage:
+            parser.error(f"baseline was recorded with --storage {data.get('storage')}, not {args.storage}")
+        baseline = {f"{r['size']}:{r['metric']}": r["seconds"] for r in data["results"]}
+    workdir = args.workdir or tempfile.mkdtemp(prefix="fc_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    cwd = os.getcwd()
+    rows = []
+    try:
+        for size in args.sizes:
+            ledger_dir = os.path.join(workdir, str(size))
+            os.makedirs(ledger_dir, exist_ok=True)
+            os.chdir(ledger_dir)
+            if not os.path.exists(FinTrack.DATA_FILE):
+                start = time.perf_counter()
+                generate_ledger(FinTrack.DATA_FILE, size)
+                print(f"{size}: generated in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+            for name in (FinTrack.SNAPSHOT_FILE, FinTrack.JOURNAL_FILE, FinTrack.DB_FILE, FinTrack.BIN_FILE):
+                if os.path.exists(name):
+                    os.remove(name)
+            results = bench_engine(args.storage, args.repeat)
+            if not args.no_ui:
+                ui = bench_ui(args.repeat)
+                if ui is None:
+                    print("no display, skipping UI timings", file=sys.stderr)
+                    args.no_ui = True
+                else:
+                    results.update(ui)
+            for metric, seconds in results.items():
+                rows.append({"size": size, "metric": metric, "seconds": round(seconds, 6)})
+                print(f"{size:>10} {metric:<24} {seconds * 1000:10.2f} ms", file=sys.stderr)
+    finally:
+        os.chdir(cwd)
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "storage": args.storage,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": rows
+    }
+    status = 0
+    if baseline is not None:
+        report["regressions"] = compare({f"{r['size']}:{r['metric']}": r["seconds"] for r in rows},
+                                        baseline, args.tolerance, args.floor)
+        for r in report["regressions"]:
+            print(f"REGRESSION {r['metric']}: {r['baseline']:.4f}s -> {r['seconds']:.4f}s ({r['ratio']:.2f}x)", file=sys.stderr)
+        status = 1 if report["regressions"] else 0
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
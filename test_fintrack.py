@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+import FinTrack
+from FinTrack import JsonStore, Ledger
+
+
+def test_item_search_without_purchases(tmp_path):
+    ledger = Ledger(JsonStore(str(tmp_path / "fc_data.json")))
+    ledger.add_income(10000, "Salary")
+    ledger.add_income(-2500, "Rent")
+    assert len(ledger.search("milk")) == 0
+    assert len(FinTrack.SearchResult(ledger.operations, ledger.search("milk"))) == 0
+
+
+def test_search_result_follows_older_batches(tmp_path):
+    ledger = Ledger(JsonStore(str(tmp_path / "fc_data.json")))
+    ledger.add_to_basket(FinTrack.Item("Milk", "Food", 150))
+    ledger.check_out()
+    ledger.add_income(500, "Gift")
+    result = FinTrack.SearchResult(ledger.operations, ledger.search("milk"))
+    older = [FinTrack.Operation("Income (Salary)", 100, 100, FinTrack.datetime(2000, 1, 1))]
+    ledger.insert_older(older)
+    result.shift(0, len(older))
+    assert [op.kind for op in result] == ["Purchase"]
+
+
+def test_to_cents_rejects_out_of_range():
+    assert FinTrack.to_cents(12.345) == 1234
+    for amount in (float("inf"), float("-inf"), 1e300):
+        with pytest.raises(OverflowError):
+            FinTrack.to_cents(amount)
+
+
+def test_edit_moves_later_balances(tmp_path, monkeypatch):
+    monkeypatch.setattr(FinTrack, "OPERATION_CHUNK", 4)
+    path = str(tmp_path / "fc_data.db")
+    ledger = Ledger(FinTrack.SqliteStore(path, str(tmp_path / "fc_data.json")))
+    ledger.load()
+    for amount in range(1, 21):
+        ledger.add_income(amount * 100, "Salary")
+    old = ledger.operations[1]
+    ledger.edit_operation(1, FinTrack.Operation(old.kind, old.amount + 50, 0, old.timestamp))
+    ledger.delete_operation(5)
+    expected = list(np.cumsum([op.amount for op in ledger.operations]))
+    assert [op.balance for op in ledger.operations] == expected
+    assert list(ledger.operations.column("balance", 0, len(ledger.operations))) == expected
+    assert ledger.balance == expected[-1]
+    ledger.close()
+    reloaded = Ledger(FinTrack.SqliteStore(path, str(tmp_path / "fc_data.json")))
+    reloaded.load()
+    assert [op.balance for op in reloaded.operations] == expected
+    reloaded.store.detach()